@@ -0,0 +1,129 @@
+# skylight/animation_file.py
+# Pre-rendered animations, played from a memory-mapped file by the "file" effect.
+#
+#   python -m skylight.animation_file info rainbow.sky
+#
+# A file is a 32 byte header followed by frame_count frames of led_count pixels each, every pixel
+# in the header's pixel order at full brightness. Frames are read from the page cache as they play,
+# so a long animation costs no more memory or cpu than a short one.
+#
+#   magic      4s  b"SKYA"
+#   version    B   1
+#   order      4s  pixel order, e.g. b"RGB\0", b"GRB\0" or b"GRBW"
+#   led_count  H
+#   fps        H   frames per second of the animation, independent of the strip's fps
+#   frames     I   frame count
+#   loop_start I   first frame of the loop
+#   loop_end   I   frame after the loop, equal to loop_start to play once and hold the last frame
+#
+# Files are written offline with write_animation, e.g. on a desktop:
+#
+#   frames = (render_my_frame(t) for t in range(600))      # bytes of led_count * 3
+#   write_animation("sunrise.sky", frames, led_count=60, fps=30, loop_start=300)
+import argparse
+import mmap
+import struct
+
+HEADER = struct.Struct('<4sB3x4sHHIII4x')
+MAGIC = b'SKYA'
+VERSION = 1
+
+class AnimationFile:
+    """A pre-rendered animation memory-mapped from disk."""
+
+    def __init__(self, path):
+        self.path = path
+        try:
+            with open(path, 'rb') as file:
+                self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError) as e:
+            raise ValueError(f"Cannot open animation {path}: {e}")
+        if len(self.map) < HEADER.size:
+            raise ValueError(f"Not an animation file: {path}")
+        (magic, version, order, self.led_count, self.fps,
+         self.frame_count, self.loop_start, self.loop_end) = HEADER.unpack_from(self.map)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"Not an animation file: {path}")
+        self.pixel_order = order.rstrip(b'\0').decode('ascii', 'replace')
+        if sorted(self.pixel_order.replace('W', '')) != ['B', 'G', 'R']:
+            raise ValueError(f"Unknown pixel order {self.pixel_order!r} in {path}")
+        self.positions = tuple(self.pixel_order.index(channel) for channel in 'RGB')
+        self.bpp = len(self.pixel_order)
+        self.frame_size = self.led_count * self.bpp
+        if not self.frame_count or not self.fps or len(self.map) < HEADER.size + self.frame_count * self.frame_size:
+            raise ValueError(f"Truncated animation file: {path}")
+        if not self.loop_start <= self.loop_end <= self.frame_count:
+            raise ValueError(f"Invalid loop {self.loop_start}-{self.loop_end} in {path}")
+        self.view = memoryview(self.map)
+
+    def frame_index(self, elapsed):
+        """Index of the frame shown elapsed seconds into playback, looping between the loop points."""
+        index = int(elapsed * self.fps)
+        if index >= self.loop_end > self.loop_start:
+            index = self.loop_start + (index - self.loop_start) % (self.loop_end - self.loop_start)
+        return min(index, self.frame_count - 1)
+
+    def frame(self, index):
+        """The pixels of frame index, a view into the mapped file."""
+        offset = HEADER.size + index * self.frame_size
+        return self.view[offset:offset + self.frame_size]
+
+    def get_state(self):
+        return {
+            "led_count": self.led_count,
+            "pixel_order": self.pixel_order,
+            "fps": self.fps,
+            "frames": self.frame_count,
+            "loop": [self.loop_start, self.loop_end],
+        }
+
+class Playback:
+    """One segment playing an AnimationFile, from its first frame when first shown."""
+
+    def __init__(self, animation):
+        self.animation = animation
+        self.started = None
+
+    def current_frame(self, now):
+        """The frame to show at time.monotonic() now."""
+        if self.started is None:
+            self.started = now
+        return self.animation.frame(self.animation.frame_index(now - self.started))
+
+def write_animation(path, frames, led_count, fps, pixel_order="RGB", loop_start=0, loop_end=None):
+    """Write frames, an iterable of led_count pixels each in pixel_order, as an animation file.
+
+    Frames are written as they are produced, so they never need to fit in memory together.
+    loop_end defaults to the frame count, looping the frames from loop_start forever.
+    """
+    frame_size = led_count * len(pixel_order)
+    with open(path, 'wb') as file:
+        file.write(bytes(HEADER.size))
+        frame_count = 0
+        for frame in frames:
+            if len(frame) != frame_size:
+                raise ValueError(f"Frame {frame_count} has {len(frame)} bytes instead of {frame_size}")
+            file.write(frame)
+            frame_count += 1
+        loop_end = frame_count if loop_end is None else loop_end
+        if not 0 <= loop_start <= loop_end <= frame_count:
+            raise ValueError(f"Invalid loop {loop_start}-{loop_end} for {frame_count} frames")
+        file.seek(0)
+        file.write(HEADER.pack(MAGIC, VERSION, pixel_order.encode('ascii'), led_count, fps,
+                               frame_count, loop_start, loop_end))
+    return frame_count
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect pre-rendered skylight animations")
+    commands = parser.add_subparsers(dest="command", required=True)
+    info_parser = commands.add_parser("info", help="print the header of an animation file")
+    info_parser.add_argument("file")
+    args = parser.parse_args()
+
+    animation = AnimationFile(args.file)
+    for key, value in animation.get_state().items():
+        print(f"{key:<12} {value}")
+    print(f"{'seconds':<12} {round(animation.frame_count / animation.fps, 2)}")
+
+if __name__ == "__main__":
+    main()
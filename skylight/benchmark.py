@@ -0,0 +1,163 @@
+# skylight/benchmark.py
+# Headless benchmark of LEDController.effects_loop using the in-memory neopixel stand-in.
+#
+#   python -m skylight.benchmark                         run every mode and layout, print a table
+#   python -m skylight.benchmark --json results.json     also save the results
+#   python -m skylight.benchmark --compare results.json  fail if p50 frame time regressed
+#
+# The effect step is driven directly instead of by the effects thread, so runs do not depend on
+# wall clock scheduling and results are comparable between runs on the same machine.
+import argparse
+import json
+import platform
+import sys
+import time
+import tracemalloc
+
+import skylight.board_stub as board
+import skylight.neopixel_stub as neopixel_stub
+from skylight import led_controller
+from skylight.frame_renderer import NumpyFrameRenderer
+
+LED_COUNTS = [30, 100, 300, 1000, 2000]
+MODE_VALUES = {
+    "chase": 0,
+    "progress": 0.42,
+    "fade": 0.3,
+    "output": "1011001110001111",
+    "blink": 0,
+    "blend": 0,
+    "breathe": 0,
+    "rainbow": 0,
+}
+
+def mode_layout(mode, led_count):
+    return [[mode, MODE_VALUES[mode], led_count, "green", "dark-blue", 0]]
+
+def mixed_layout(led_count):
+    """A printer status layout: progress bar, temperature, fan outputs, heartbeat chase and a breathing tail."""
+    part = max(1, led_count // 8)
+    return [
+        ["progress", 0.42, part * 3, "green", "white", 1],
+        ["fade", 0.7, part, "blue", "red", 1],
+        ["output", "1011", 4, "cyan", "black", 1],
+        ["chase", 0, part, "white", "black", 1],
+        ["breathe", 0, max(1, led_count - part * 5 - 8), "magenta", "dark-yellow", 0],
+    ]
+
+def percentile(values, percent):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percent / 100))]
+
+def make_controller(led_count, use_numpy, cache):
+    # Always drive the stand-in, even on a Pi where the real neopixel module is installed
+    led_controller.neopixel = neopixel_stub
+    controller = led_controller.LEDController(led_count=led_count, led_pin=board.D18,
+                                              led_order=neopixel_stub.GRB, use_numpy=use_numpy)
+    controller.stop()
+    if not cache:
+        controller.cycle_cache.max_bytes = 0
+    return controller
+
+def run_frames(controller, first_frame, frames):
+    scheduler = controller.effects_thread.scheduler
+    times = []
+    for frame in range(first_frame, first_frame + frames):
+        scheduler.frame = frame
+        start = time.perf_counter()
+        controller.effects_loop()
+        times.append(time.perf_counter() - start)
+    return times
+
+def run_case(layout, led_count, use_numpy, cache, frames):
+    controller = make_controller(led_count, use_numpy, cache)
+    controller.set_data_fields(layout)
+    neopixel_stub.writes.reset()
+    times = run_frames(controller, 0, frames)
+    writes = neopixel_stub.writes.count
+
+    # Allocations are measured in a separate, shorter pass since tracing slows everything down
+    tracemalloc.start()
+    start_memory = tracemalloc.get_traced_memory()[0]
+    run_frames(controller, frames, min(frames, 64))
+    peak_memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {
+        "fps": round(len(times) / sum(times), 1),
+        "p50_ms": round(percentile(times, 50) * 1000, 4),
+        "p90_ms": round(percentile(times, 90) * 1000, 4),
+        "p99_ms": round(percentile(times, 99) * 1000, 4),
+        "max_ms": round(max(times) * 1000, 4),
+        "alloc_peak_bytes": peak_memory - start_memory,
+        "writes": writes,
+    }
+
+def run_benchmarks(led_counts, renderers, cache, frames, modes):
+    results = {}
+    layouts = [(mode, lambda n, mode=mode: mode_layout(mode, n)) for mode in modes]
+    layouts.append(("mixed", mixed_layout))
+    for renderer in renderers:
+        for led_count in led_counts:
+            for name, layout in layouts:
+                key = f"{name}/{led_count}/{renderer}"
+                results[key] = run_case(layout(led_count), led_count, renderer == "numpy", cache, frames)
+                print_result(key, results[key])
+    return results
+
+def print_result(key, result):
+    print(f"{key:<24} {result['fps']:>10} fps  p50 {result['p50_ms']:>8.3f} ms  p99 {result['p99_ms']:>8.3f} ms"
+          f"  alloc {result['alloc_peak_bytes']:>8} B  writes {result['writes']}")
+
+def compare(results, baseline, threshold):
+    """Print p50 ratios against a previous run and return the keys that regressed past threshold."""
+    regressions = []
+    for key, result in results.items():
+        previous = baseline.get(key)
+        if not previous:
+            continue
+        ratio = result["p50_ms"] / previous["p50_ms"] if previous["p50_ms"] else 1.0
+        flag = ""
+        if ratio > threshold:
+            regressions.append(key)
+            flag = "  REGRESSION"
+        print(f"{key:<24} p50 {previous['p50_ms']:>8.3f} -> {result['p50_ms']:>8.3f} ms  x{ratio:.2f}{flag}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark LEDController.effects_loop without LED hardware")
+    parser.add_argument("--frames", type=int, default=300, help="frames rendered per case")
+    parser.add_argument("--led-counts", default=",".join(str(n) for n in LED_COUNTS))
+    parser.add_argument("--modes", default=",".join(MODE_VALUES))
+    parser.add_argument("--renderer", choices=["python", "numpy", "all"], default="all")
+    parser.add_argument("--cache", action="store_true", help="keep the cycle cache enabled")
+    parser.add_argument("--json", help="save the results to this file")
+    parser.add_argument("--compare", help="compare against results saved with --json")
+    parser.add_argument("--threshold", type=float, default=1.2, help="p50 ratio counted as a regression")
+    args = parser.parse_args()
+
+    renderers = ["python", "numpy"] if args.renderer == "all" else [args.renderer]
+    if not NumpyFrameRenderer.available() and "numpy" in renderers:
+        print("numpy is not installed, skipping the numpy renderer")
+        renderers.remove("numpy")
+
+    led_counts = [int(n) for n in args.led_counts.split(",")]
+    results = run_benchmarks(led_counts, renderers, args.cache, args.frames, args.modes.split(","))
+
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump({
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                "frames": args.frames,
+                "cache": args.cache,
+                "results": results,
+            }, file, indent=2)
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)["results"]
+        if compare(results, baseline, args.threshold):
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
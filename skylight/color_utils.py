@@ -13,21 +13,41 @@ class ColorUtils:
         "magenta": (255, 0, 255),
         "yellow": (255, 255, 0),
     }
+    # Memoized lookups, keyed by color name, (color, bg_color, factors) and scale factor
+    cache_limit = 256
+    resolved_colors = {}
+    blend_tables = {}
+    scale_tables = {}
+    wheel_table = ()
 
     @staticmethod
     def add_color(name, rgb):
         """Add a new color to the dictionary."""
         ColorUtils.colors[name] = rgb
+        ColorUtils.resolved_colors.clear()
 
     @staticmethod
     def remove_color(name):
         """Remove a color from the dictionary."""
         if name in ColorUtils.colors:
             del ColorUtils.colors[name]
+            ColorUtils.resolved_colors.clear()
 
     @staticmethod
     def get_color(color):
-        """Retrieve a named color from the dictionary."""
+        """Retrieve a named color from the dictionary, resolving each name only once."""
+        if isinstance(color, str):
+            resolved = ColorUtils.resolved_colors.get(color)
+            if resolved is None:
+                if len(ColorUtils.resolved_colors) >= ColorUtils.cache_limit:
+                    ColorUtils.resolved_colors.clear()
+                resolved = ColorUtils.resolved_colors[color] = ColorUtils.resolve_color(color)
+            return resolved
+        return color
+
+    @staticmethod
+    def resolve_color(color):
+        """Parse a color name with an optional dark- or bright- prefix."""
         if isinstance(color, str):
             scale = 1.0
             if color.startswith('dark-'):
@@ -53,8 +73,33 @@ class ColorUtils:
         r2, g2, b2 = c2
         return clamp(r1*f1 + r2*f2), clamp(g1*f1 + g2*f2), clamp(b1*f1 + b2*f2)
 
+    @staticmethod
+    def blend_table(c1, c2, factors):
+        """Return blend_colors(c1, c2, f) for every f in the factors tuple, computed once per color pair."""
+        key = (tuple(c1), tuple(c2), factors)
+        table = ColorUtils.blend_tables.get(key)
+        if table is None:
+            if len(ColorUtils.blend_tables) >= ColorUtils.cache_limit:
+                ColorUtils.blend_tables.clear()
+            table = ColorUtils.blend_tables[key] = tuple(ColorUtils.blend_colors(c1, c2, f) for f in factors)
+        return table
+
+    @staticmethod
+    def scale_table(factor):
+        """Return the 256 byte table mapping a color component to clamp(component * factor)."""
+        table = ColorUtils.scale_tables.get(factor)
+        if table is None:
+            if len(ColorUtils.scale_tables) >= ColorUtils.cache_limit:
+                ColorUtils.scale_tables.clear()
+            table = ColorUtils.scale_tables[factor] = bytes(clamp(i * factor) for i in range(256))
+        return table
+
     @staticmethod
     def wheel(pos):
+        return ColorUtils.wheel_table[pos % 255]
+
+    @staticmethod
+    def compute_wheel(pos):
         pos %= 255
         if pos < 85:
             return pos * 3, 255 - pos * 3, 0
@@ -68,3 +113,5 @@ class ColorUtils:
     @staticmethod
     def scale_pixels(pixels, factor):
         return [(clamp(r * factor), clamp(g * factor), clamp(b * factor)) for r, g, b in pixels]
+
+ColorUtils.wheel_table = tuple(ColorUtils.compute_wheel(pos) for pos in range(255))
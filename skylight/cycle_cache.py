@@ -0,0 +1,61 @@
+import math
+
+class CycleCache:
+    """Ring of pre-rendered frames for render plans that repeat with the effect step.
+
+    Each frame of the cycle is rendered the first time its step comes around and replayed from the
+    ring after that. The ring belongs to one plan, compiling a new plan starts a new ring.
+    """
+
+    def __init__(self, renderer, num_steps, max_bytes=4*1024*1024):
+        self.renderer = renderer
+        self.num_steps = num_steps
+        self.max_bytes = max_bytes
+        self.plan = None
+        self.period = None
+        self.frames = []
+        self.hits = 0
+        self.misses = 0
+
+    def reset(self, plan):
+        self.plan = plan
+        self.period = self.plan_period(plan)
+        self.frames = [None] * self.period if self.period else []
+
+    def plan_period(self, plan):
+        """Return the number of steps after which the plan repeats, or None if it should not be cached."""
+        period = 1
+        for segment in plan.segments:
+            segment_period = self.renderer.period(segment)
+            if not segment_period:
+                return None
+            period = math.lcm(period, segment_period)
+        # Steps are below num_steps, so a longer cycle never comes around
+        period = min(period, self.num_steps)
+        if period * len(self.renderer.frame.buf) > self.max_bytes:
+            return None
+        return period
+
+    def render(self, plan, step):
+        """Render the plan for step into the renderer's frame buffer, from the ring when possible."""
+        if plan is not self.plan:
+            self.reset(plan)
+        if not self.period:
+            self.renderer.render(plan, step)
+            return
+        index = step % self.period
+        frame = self.frames[index]
+        if frame is None:
+            self.misses += 1
+            self.renderer.render(plan, step)
+            self.frames[index] = bytes(self.renderer.frame.buf)
+        else:
+            self.hits += 1
+            self.renderer.frame.buf[:] = frame
+
+    def get_stats(self):
+        return {
+            "period": self.period,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
@@ -0,0 +1,174 @@
+import ast
+import configparser
+from skylight.status_display import StatusDisplay
+
+# Rules are tried in order and the first one whose condition holds picks the display.
+# These reproduce the built-in behaviour and are written to a new skylight.conf as [rule <name>] sections.
+DEFAULT_RULES = [
+    ("warming_up", {
+        "when": 'print_stats.state == "printing" and extruder.target > 0 '
+                'and abs(extruder.temperature - extruder.target) > 5',
+        "display": "temp",
+        "value": "extruder.temperature / extruder.target"}),
+    ("printing", {
+        "when": 'print_stats.state == "printing"',
+        "display": "progress",
+        "value": "display_status.progress"}),
+    ("paused", {
+        "when": 'print_stats.state == "paused"',
+        "display": "paused"}),
+    ("heating", {
+        "when": "extruder.target > 0",
+        "display": "temp",
+        "value": "extruder.temperature / extruder.target"}),
+    ("cooling_down", {
+        "when": "extruder.temperature > 50",
+        "display": "temp",
+        "value": "extruder.temperature / 250"}),
+    ("idle", {
+        "when": "True",
+        "display": "idle"}),
+]
+
+FUNCTIONS = {"abs": abs, "min": min, "max": max, "round": round}
+ALLOWED_NODES = (ast.Expression, ast.BoolOp, ast.And, ast.Or, ast.UnaryOp, ast.Not, ast.USub, ast.UAdd,
+                 ast.BinOp, ast.Add, ast.Sub, ast.Mult, ast.Div, ast.Mod, ast.Compare, ast.Eq, ast.NotEq,
+                 ast.Lt, ast.LtE, ast.Gt, ast.GtE, ast.In, ast.NotIn, ast.IfExp, ast.Constant, ast.Tuple,
+                 ast.Call, ast.Name, ast.Load)
+
+class Expression:
+    """A rule expression over Moonraker fields written object.field, compiled once.
+
+    Object names with spaces are quoted: "temperature_sensor mcu".temperature
+    Missing fields read as 0.
+    """
+
+    def __init__(self, source):
+        self.source = source
+        self.fields = []
+        # The names replace_fields made, a name written in the rule itself is never a field
+        self.field_names = set()
+        tree = ast.parse(source.strip(), mode="eval")
+        tree = ast.fix_missing_locations(self.replace_fields(tree))
+        for node in ast.walk(tree):
+            if not isinstance(node, ALLOWED_NODES):
+                raise ValueError(f"Not allowed in a rule: {type(node).__name__} in {source!r}")
+            if isinstance(node, ast.Call) and (not isinstance(node.func, ast.Name) or node.keywords
+                                               or node.func.id not in FUNCTIONS):
+                raise ValueError(f"Unknown function in rule {source!r}")
+            if isinstance(node, ast.Name) and node.id not in FUNCTIONS and node not in self.field_names:
+                raise ValueError(f"Unknown name {node.id!r} in rule {source!r}, fields are written object.field")
+        self.code = compile(tree, "<rule>", "eval")
+
+    def replace_fields(self, tree):
+        """Turn every object.field into a local variable holding the field's value."""
+        fields = self.fields
+        field_names = self.field_names
+
+        class Fields(ast.NodeTransformer):
+            def visit_Attribute(self, node):
+                if isinstance(node.value, ast.Name):
+                    name = node.value.id
+                elif isinstance(node.value, ast.Constant) and isinstance(node.value.value, str):
+                    name = node.value.value
+                else:
+                    raise ValueError(f"Fields are written object.field: {ast.unparse(node)}")
+                if (name, node.attr) not in fields:
+                    fields.append((name, node.attr))
+                field = ast.copy_location(ast.Name(id=f"_{fields.index((name, node.attr))}", ctx=ast.Load()), node)
+                field_names.add(field)
+                return field
+
+        return Fields().visit(tree)
+
+    def evaluate(self, state):
+        values = {f"_{i}": state.get(name, key, 0) for i, (name, key) in enumerate(self.fields)}
+        try:
+            return eval(self.code, {"__builtins__": {}, **FUNCTIONS}, values)
+        except (ArithmeticError, TypeError, ValueError):
+            return None
+
+class Rule:
+    def __init__(self, name, when, display=None, value="0", effect=None, color="white", bg_color="black"):
+        self.name = name
+        self.condition = Expression(when)
+        self.value = Expression(value)
+        # A rule with its own effect gets a layout of the same name
+        self.layout = (effect, color, bg_color) if effect else None
+        self.display = name if effect else display
+        self.fields = set(self.condition.fields) | set(self.value.fields)
+
+class RuleSet:
+    """Rules mapping printer status to a StatusDisplay mode and value, compiled once at startup."""
+
+    def __init__(self, rules):
+        self.rules = rules
+        self.layouts = dict(StatusDisplay.layouts)
+        self.layouts.update({rule.display: rule.layout for rule in rules if rule.layout})
+        for rule in rules:
+            if rule.display not in self.layouts:
+                raise ValueError(f"Rule {rule.name} shows unknown display {rule.display!r}")
+        # Decision table index: for every field, the rules whose condition reads it
+        self.dependents = {}
+        for index, rule in enumerate(rules):
+            for field in rule.condition.fields:
+                self.dependents.setdefault(field, []).append(index)
+
+    @classmethod
+    def from_config(cls, config):
+        """Rules from the [rule <name>] sections in file order, or the default rules without any."""
+        sections = [name for name in config.sections() if name.startswith('rule ')]
+        if not sections:
+            return cls.default()
+        rules = []
+        for section in sections:
+            try:
+                # Raw values, % is the modulo operator in a rule and not an interpolation
+                rules.append(Rule(section[len('rule '):].strip(), **dict(config.items(section, raw=True))))
+            except (TypeError, SyntaxError, configparser.Error) as e:
+                raise ValueError(f"Invalid [{section}]: {e}")
+        return cls(rules)
+
+    @classmethod
+    def default(cls):
+        return cls([Rule(name, **options) for name, options in DEFAULT_RULES])
+
+    def objects(self, base=None):
+        """Moonraker objects and fields the rules read, for printer.objects.subscribe."""
+        objects = {name: list(fields) for name, fields in (base or {}).items()}
+        for rule in self.rules:
+            for name, key in sorted(rule.fields):
+                if key not in objects.setdefault(name, []):
+                    objects[name].append(key)
+        return objects
+
+    def evaluator(self):
+        return RuleEvaluator(self)
+
+class RuleEvaluator:
+    """The decision state of one printer: conditions are re-evaluated only when a field they read changed."""
+
+    def __init__(self, rule_set):
+        self.rule_set = rule_set
+        self.matches = [None] * len(rule_set.rules)
+        self.evaluations = 0
+
+    def evaluate(self, state, changed_fields=None):
+        """Return (display, value) of the first rule that holds. changed_fields None re-evaluates every rule."""
+        rules = self.rule_set.rules
+        if changed_fields is None:
+            stale = range(len(rules))
+        else:
+            stale = {index for field in changed_fields for index in self.rule_set.dependents.get(field, ())}
+        for index in stale:
+            self.matches[index] = bool(rules[index].condition.evaluate(state))
+            self.evaluations += 1
+        for index, rule in enumerate(rules):
+            # Rules that read no fields, like "True", are evaluated on first use
+            if self.matches[index] is None:
+                self.matches[index] = bool(rule.condition.evaluate(state))
+                self.evaluations += 1
+            if self.matches[index]:
+                value = rule.value.evaluate(state)
+                return rule.display, value if isinstance(value, (int, float)) else 0
+        return None, 0
@@ -1,19 +1,114 @@
+import math
 import threading
 import time
 
+class FrameScheduler:
+    """Frame deadlines at a fixed target rate, anchored to the start time so timing does not drift.
+
+    The frame counter always advances at fps, so effects keep their speed, but the scheduler can wake only
+    on every stride-th frame, or sleep until woken when nothing on the strip is changing.
+    """
+
+    def __init__(self, fps=30, max_fps=None, min_fps=1):
+        self.frame = 0
+        self.overruns = 0
+        self.skipped_frames = 0
+        self.stride = 1
+        self.anchor = None
+        self.max_fps = max_fps
+        self.min_fps = min_fps
+        self.set_fps(fps)
+
+    def set_fps(self, fps):
+        self.fps = fps
+        self.frame_period = 1.0 / fps
+        self.anchor = None
+
+    def set_limits(self, max_fps=None, min_fps=None):
+        """Cap the rate frames are rendered at, and set how often a static strip is still refreshed."""
+        self.max_fps = max_fps
+        self.min_fps = min_fps
+
+    def wait(self, stride=1, wake=None):
+        """Sleep until the next frame that is a multiple of stride. Deadlines already missed are skipped.
+
+        stride 0 means the frame is static: sleep until the wake event is set, or until the min_fps refresh.
+        """
+        now = time.monotonic()
+        # set_fps may run on another thread meanwhile, this wait keeps the rate it started with
+        anchor, period = self.anchor, self.frame_period
+        if anchor is None:
+            anchor = self.anchor = now - self.frame * period
+        if stride and self.max_fps and self.fps / stride > self.max_fps:
+            stride = math.ceil(self.fps / self.max_fps)
+        self.stride = stride
+        if not stride:
+            timeout = 1.0 / self.min_fps if self.min_fps else None
+            if wake is not None:
+                wake.wait(timeout)
+            elif timeout:
+                time.sleep(timeout)
+            self.frame = max(self.frame + 1, int((time.monotonic() - anchor) / period))
+            return
+        target = self.frame + stride - self.frame % stride
+        deadline = anchor + target * period
+        if now > deadline:
+            # The last frame overran its budget, drop the deadlines that have already passed
+            self.overruns += 1
+            late = int((now - anchor) / period)
+            late -= late % stride
+            self.skipped_frames += (late - target) // stride
+            self.frame = late
+        else:
+            if wake is not None:
+                if wake.wait(deadline - now):
+                    # Woken by a state change, render it now on the current frame
+                    self.frame = max(self.frame + 1, int((time.monotonic() - anchor) / period))
+                    return
+            else:
+                time.sleep(deadline - now)
+            self.frame = target
+
+    def effective_fps(self):
+        if not self.stride:
+            return self.min_fps or 0
+        return round(self.fps / self.stride, 2)
+
+    def get_stats(self):
+        return {
+            "fps": self.fps,
+            "effective_fps": self.effective_fps(),
+            "frame": self.frame,
+            "overruns": self.overruns,
+            "skipped_frames": self.skipped_frames,
+        }
+
 class EffectsThread(threading.Thread):
-    def __init__(self, update_interval=0.1):
+    """Calls the effect function once per frame.
+
+    The effect function may return how many frames pass before its output changes again, 0 when it
+    is static, and the thread sleeps until then or until wake() is called. None means every frame.
+    """
+
+    def __init__(self, fps=30, max_fps=None, min_fps=1):
         super().__init__()
-        self.update_interval = update_interval
+        self.scheduler = FrameScheduler(fps, max_fps, min_fps)
+        self.wake_event = threading.Event()
         self.effect_function = None
         self.effect_params = {}
         self.running = False
 
     def run(self):
         while self.running:
+            stride = 1
             if self.effect_function:
-                self.effect_function(**self.effect_params)
-            time.sleep(self.update_interval)
+                self.wake_event.clear()
+                stride = self.effect_function(**self.effect_params)
+            self.scheduler.wait(1 if stride is None else stride, self.wake_event)
+
+    def wake(self):
+        """Render the next frame now instead of at the next scheduled one."""
+        self.wake_event.set()
 
     def set_effect(self, effect_function, **params):
         self.effect_function = effect_function
@@ -25,4 +120,5 @@ class EffectsThread(threading.Thread):
 
     def stop(self):
         self.running = False
+        self.wake_event.set()
         self.join()
@@ -0,0 +1,94 @@
+from collections import namedtuple
+from skylight.color_utils import ColorUtils, clamp
+
+UNSCALED = bytes(range(256))
+
+# Everything that depends on the brightness: the component scale table and the wire encoded color wheel
+Palette = namedtuple('Palette', ['brightness', 'scale', 'wheel'])
+
+class FrameBuffer:
+    """A preallocated frame in the strip's wire order (GRB, RGB, ...) with brightness already applied."""
+
+    def __init__(self, led_count, pixel_order="GRB", brightness=1.0):
+        self.led_count = led_count
+        if isinstance(pixel_order, str):
+            # e.g. "GRB": wire byte 0 is green, 1 is red, 2 is blue
+            self.positions = (pixel_order.index('R'), pixel_order.index('G'), pixel_order.index('B'))
+            self.bpp = len(pixel_order)
+        else:
+            # Older neopixel releases use tuples holding the wire position of r, g, b (and w)
+            self.positions = tuple(pixel_order[:3])
+            self.bpp = len(pixel_order)
+        self.buf = bytearray(led_count * self.bpp)
+        self.blank = bytes(len(self.buf))
+        self.set_brightness(brightness)
+
+    def palette(self, brightness):
+        """Return the Palette for brightness without applying it, for plans compiled ahead of the change."""
+        scale = ColorUtils.scale_table(brightness)
+        return Palette(brightness, scale, tuple(self.encode(color, scale) for color in ColorUtils.wheel_table))
+
+    def set_brightness(self, brightness, palette=None):
+        self.brightness, self.scale, self.wheel = palette or self.palette(brightness)
+        self.unscaled = self.scale == UNSCALED
+
+    def encode(self, color, scale=None):
+        """Return the wire bytes for one pixel of an (r, g, b) color, scaled by scale or the current brightness."""
+        scale = self.scale if scale is None else scale
+        wire = [0] * self.bpp
+        for channel, position in enumerate(self.positions):
+            wire[position] = scale[clamp(color[channel])]
+        return bytes(wire)
+
+    def clear(self):
+        self.buf[:] = self.blank
+
+    def fill(self, color):
+        self.buf[:] = self.encode(color) * self.led_count
+
+    def set_pixel(self, index, color):
+        self.buf[index*self.bpp:(index+1)*self.bpp] = self.encode(color)
+
+    def write_rgb(self, index, data):
+        """Write packed r, g, b bytes starting at pixel index, clipped to the strip. Returns the pixel count."""
+        return self.write_pixels(index, data)
+
+    def write_pixels(self, index, data, positions=(0, 1, 2), bpp=3):
+        """Write pixels of bpp bytes with r, g, b at positions from pixel index, clipped to the strip.
+
+        Pixels already in the strip's wire order are copied as they are, others are reordered a channel
+        at a time. Returns the pixel count.
+        """
+        count = min(len(data) // bpp, self.led_count - index)
+        if count <= 0:
+            return 0
+        data = data[:count * bpp]
+        start, end = index * self.bpp, (index + count) * self.bpp
+        if bpp == self.bpp and positions == self.positions:
+            self.buf[start:end] = data if self.unscaled else bytes(data).translate(self.scale)
+            return count
+        data = bytes(data).translate(self.scale)
+        if self.bpp > 3:
+            # Pixels without a white channel leave it dark
+            self.buf[start:end] = bytes(end - start)
+        for source, position in zip(positions, self.positions):
+            self.buf[start + position:end:self.bpp] = data[source::bpp]
+        return count
+
+    def view(self):
+        """A read-only view of the wire bytes, valid until the next frame is rendered."""
+        return memoryview(self.buf).toreadonly()
+
+    def rows(self):
+        """Decode the buffer into a list of brightness scaled (r, g, b) tuples."""
+        buf, bpp = self.buf, self.bpp
+        r, g, b = self.positions
+        return [(buf[i+r], buf[i+g], buf[i+b]) for i in range(0, len(buf), bpp)]
+
+    def show(self, strip, neopixel_write=None):
+        """Send the buffer to the strip, directly when the driver's neopixel_write is available."""
+        if neopixel_write:
+            neopixel_write(strip.pin, self.buf)
+        else:
+            strip[:] = self.rows()
+            strip.show()
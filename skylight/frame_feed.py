@@ -0,0 +1,166 @@
+import asyncio
+import struct
+import time
+
+# Binary frame message: kind, frame sequence number, range count, then per range its first pixel,
+# pixel count and the r, g, b bytes of those pixels
+MESSAGE = struct.Struct('<BIH')
+RANGE = struct.Struct('<HH')
+FULL_FRAME = 0
+DELTA_FRAME = 1
+# Unchanged pixels between two changed ranges are sent anyway when that is cheaper than a range header
+MERGE_GAP = 2
+HISTORY = 8
+
+class Subscriber:
+    def __init__(self, websocket, fps):
+        self.websocket = websocket
+        self.interval = 1.0 / fps
+        self.next_time = 0
+        self.sequence = None
+        self.sending = None
+        self.sent = 0
+        self.skipped = 0
+
+class FrameFeed:
+    """Sends the frames shown on the strip to websocket subscribers, each at its own maximum rate.
+
+    Frames are sent as binary messages holding only the pixel ranges that changed since the frame the
+    subscriber last received. Encodings are shared, subscribers that received the same frame get the same
+    message, so N viewers at one rate cost one encode per frame. A subscriber still busy receiving its last
+    message skips frames instead of queueing them, and the render loop never waits for the feed.
+    """
+
+    def __init__(self, led_controller, max_fps=30):
+        self.led_controller = led_controller
+        self.max_fps = max_fps
+        self.subscribers = {}
+        self.task = None
+        self.sequence = 0
+        self.frame_count = None
+        self.history = {}
+        self.encodings = {}
+        self.encodes = 0
+        self.positions = None
+        self.shown = None
+        # In process controllers hand over each frame as it is shown while anyone is subscribed,
+        # a RenderProcess is polled instead
+        self.on_show = hasattr(led_controller, "add_show_callback")
+        self.watching = False
+
+    def subscribe(self, websocket, fps=10):
+        if self.positions is None:
+            self.positions, self.bpp = self.led_controller.get_pixel_format()
+        fps = min(max(float(fps), 0.1), self.max_fps)
+        self.subscribers[websocket] = Subscriber(websocket, fps)
+        if self.on_show and not self.watching:
+            self.watching = True
+            self.led_controller.add_show_callback(self.frame_shown)
+        if self.task is None or self.task.done():
+            self.task = asyncio.ensure_future(self.run())
+        return fps
+
+    def unsubscribe(self, websocket):
+        self.subscribers.pop(websocket, None)
+        if self.watching and not self.subscribers:
+            # Nobody watches, the render thread stops copying frames
+            self.watching = False
+            self.led_controller.remove_show_callback(self.frame_shown)
+
+    async def run(self):
+        while self.subscribers:
+            interval = min(subscriber.interval for subscriber in self.subscribers.values())
+            self.capture()
+            now = time.monotonic()
+            for subscriber in list(self.subscribers.values()):
+                if now >= subscriber.next_time:
+                    self.send(subscriber, now)
+            await asyncio.sleep(interval)
+        self.encodings = {}
+
+    def frame_shown(self, buf):
+        # Runs on the render thread and only copies the frame, the controller also calls it with the
+        # frame on the strip when the callback is added, so a static strip is seen by new subscribers
+        self.shown = (self.shown[0] + 1 if self.shown else 1, bytes(buf))
+
+    def capture(self):
+        """Take the last frame shown if it is new, decoded to r, g, b bytes."""
+        if self.on_show:
+            if self.shown is None:
+                return
+            frame_count, wire = self.shown
+        else:
+            frame_count = self.led_controller.get_frame_count()
+        if frame_count == self.frame_count:
+            return
+        self.frame_count = frame_count
+        if not self.on_show:
+            wire = self.led_controller.get_pixels()
+        rgb = bytearray(len(wire) // self.bpp * 3)
+        for channel, position in enumerate(self.positions):
+            rgb[channel::3] = wire[position::self.bpp]
+        rgb = bytes(rgb)
+        if self.sequence in self.history and self.history[self.sequence] == rgb:
+            return
+        self.sequence += 1
+        self.history[self.sequence] = rgb
+        self.history.pop(self.sequence - HISTORY, None)
+        self.encodings = {}
+
+    def send(self, subscriber, now):
+        if subscriber.sequence == self.sequence or self.sequence not in self.history:
+            return
+        if subscriber.sending is not None and not subscriber.sending.done():
+            subscriber.skipped += 1
+            return
+        message = self.encodings.get(subscriber.sequence)
+        if message is None:
+            message = self.encodings[subscriber.sequence] = self.encode(subscriber.sequence)
+        subscriber.sending = asyncio.ensure_future(self.deliver(subscriber, message))
+        subscriber.sequence = self.sequence
+        subscriber.next_time = now + subscriber.interval
+        subscriber.sent += 1
+
+    async def deliver(self, subscriber, message):
+        try:
+            await subscriber.websocket.send(message)
+        except Exception:
+            self.unsubscribe(subscriber.websocket)
+
+    def encode(self, base_sequence):
+        """Encode the current frame as the ranges that changed since base_sequence, or in full."""
+        self.encodes += 1
+        frame = self.history[self.sequence]
+        base = self.history.get(base_sequence)
+        if base is None or len(base) != len(frame):
+            ranges = [(0, len(frame) // 3)]
+            kind = FULL_FRAME
+        else:
+            ranges = self.changed_ranges(base, frame)
+            kind = DELTA_FRAME
+        parts = [MESSAGE.pack(kind, self.sequence, len(ranges))]
+        for start, count in ranges:
+            parts.append(RANGE.pack(start, count))
+            parts.append(frame[start * 3:(start + count) * 3])
+        return b''.join(parts)
+
+    def changed_ranges(self, base, frame):
+        ranges = []
+        for pixel in range(len(frame) // 3):
+            i = pixel * 3
+            if base[i:i + 3] == frame[i:i + 3]:
+                continue
+            if ranges and pixel - (ranges[-1][0] + ranges[-1][1]) <= MERGE_GAP:
+                ranges[-1][1] = pixel - ranges[-1][0] + 1
+            else:
+                ranges.append([pixel, 1])
+        return ranges
+
+    def get_stats(self):
+        return {
+            "subscribers": len(self.subscribers),
+            "sequence": self.sequence,
+            "encodes": self.encodes,
+            "sent": sum(subscriber.sent for subscriber in self.subscribers.values()),
+            "skipped": sum(subscriber.skipped for subscriber in self.subscribers.values()),
+        }
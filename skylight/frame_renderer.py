@@ -0,0 +1,294 @@
+import math
+import os
+import time
+from itertools import repeat
+from skylight.color_utils import ColorUtils
+# numpy is imported when a NumpyFrameRenderer is first asked for, loading it takes a good part of a
+# second on a Pi and the strip should light up before that
+np = None
+
+def load_numpy():
+    global np
+    if np is None:
+        try:
+            import numpy
+            np = numpy
+        except ImportError:
+            np = False
+    return np
+
+BLACK = (0, 0, 0)
+BIT_ONE = ord('1')
+
+class FrameRenderer:
+    """Render a RenderPlan in place into a FrameBuffer, one slice assignment per segment."""
+
+    def __init__(self, frame, breathe_factors, animation_dir=None):
+        self.frame = frame
+        self.led_count = frame.led_count
+        self.breathe_factors = breathe_factors
+        # Animation files by path and their playback by (path, start, length) of the segment showing them,
+        # relative paths are found in animation_dir
+        self.animation_dir = animation_dir
+        self.animations = {}
+        self.playbacks = {}
+        self.renderers = {
+            "chase": self.render_chase,
+            "progress": self.render_progress,
+            "fade": self.render_fade,
+            "output": self.render_output,
+            "blink": self.render_blink,
+            "blend": self.render_blend,
+            "breathe": self.render_breathe,
+            "rainbow": self.render_rainbow,
+            "file": self.render_file,
+        }
+        self.last_frame = bytearray(len(frame.buf))
+        self.last_frame_valid = False
+        self.wheel_offsets = [index * 256 // self.led_count for index in range(self.led_count)]
+        self.color_tables = {}
+
+    def render(self, plan, step):
+        """Render a full frame for the given effect step into the frame buffer."""
+        frame = self.frame
+        frame.clear()
+        for segment in plan.segments:
+            segment.render(frame.buf, segment, step)
+
+    def changed(self):
+        """Return True if the frame buffer differs from the last time this was called, and remember it."""
+        buf = self.frame.buf
+        if self.last_frame_valid and buf == self.last_frame:
+            return False
+        self.last_frame[:] = buf
+        self.last_frame_valid = True
+        return True
+
+    def invalidate(self):
+        """Forget the last frame, the strip was written outside the renderer."""
+        self.last_frame_valid = False
+
+    def encode(self, color, palette=None):
+        return self.frame.encode(color, palette and palette.scale)
+
+    def color_table(self, mode, color, bg_color, palette=None):
+        """Return the wire color lookup table for modes whose colors depend on the effect step.
+
+        blend and breathe get a (color, bg_color) pair per step, rainbow gets the color wheel.
+        Colors are encoded with palette, the frame's current brightness without one.
+        """
+        if mode == "rainbow":
+            return self.wheel_table(palette)
+        if mode not in ("blend", "breathe"):
+            return None
+        key = (mode, tuple(color), tuple(bg_color), palette.brightness if palette else self.frame.brightness)
+        table = self.color_tables.get(key)
+        if table is None:
+            if mode == "blend":
+                colors = ColorUtils.blend_table(color, bg_color, self.breathe_factors)
+                bg_colors = repeat(bg_color)
+            else:
+                colors = ColorUtils.blend_table(BLACK, color, self.breathe_factors)
+                bg_colors = ColorUtils.blend_table(BLACK, bg_color, self.breathe_factors)
+            if len(self.color_tables) >= ColorUtils.cache_limit:
+                self.color_tables.clear()
+            encode = self.encode
+            table = self.color_tables[key] = tuple((encode(c, palette), encode(bg, palette))
+                                                   for c, bg in zip(colors, bg_colors))
+        return table
+
+    def wheel_table(self, palette=None):
+        return (palette or self.frame).wheel
+
+    def playback(self, path, start, length, restart=False):
+        """Return the Playback of the animation file at path over a segment.
+
+        A segment that keeps its place and file keeps playing through recompiled plans, unless restart.
+        New playbacks are kept by keep_playbacks once their plan is published.
+        """
+        if not isinstance(path, str) or not path:
+            raise ValueError("A file segment's value is the path of an animation file")
+        if self.animation_dir and not os.path.isabs(path):
+            path = os.path.join(self.animation_dir, path)
+        key = (path, start, length)
+        playback = None if restart else self.playbacks.get(key)
+        if playback is None:
+            # Imported on first use, so python -m skylight.animation_file does not find it already loaded
+            from skylight.animation_file import AnimationFile, Playback
+            animation = self.animations.get(path)
+            if animation is None:
+                animation = self.animations[path] = AnimationFile(path)
+            playback = Playback(animation)
+        return playback
+
+    def keep_playbacks(self, plan):
+        """Keep the playbacks of the published plan, the files and playbacks it does not show start over."""
+        self.playbacks = {(segment.table.animation.path, segment.start, segment.length): segment.table
+                          for segment in plan.segments if segment.mode == "file"}
+        self.animations = {playback.animation.path: playback.animation for playback in self.playbacks.values()}
+
+    def period(self, segment):
+        """Return the number of effect steps after which the segment repeats, or None if it never does."""
+        mode = segment.mode
+        if mode in ("progress", "fade", "output"):
+            return 1
+        if mode == "chase":
+            return 3 * segment.length
+        if mode == "blink":
+            return segment.length
+        if mode in ("blend", "breathe"):
+            return len(self.breathe_factors)
+        if mode == "rainbow":
+            return len(ColorUtils.wheel_table)
+        # file frames follow the clock and are already rendered, caching them would only copy them
+        return None
+
+    def change_interval(self, segment, fps=30):
+        """Return how many effect steps pass between changes of the segment at fps, 0 if it is static."""
+        mode = segment.mode
+        if mode == "chase":
+            return 3
+        if mode in ("blink", "blend", "breathe", "rainbow"):
+            return 1
+        if mode == "file":
+            # A file slower than the strip only needs a frame as often as its own frames change
+            return max(1, int(fps // segment.table.animation.fps))
+        return 0
+
+    def plan_interval(self, plan, fps=30):
+        """Steps between changes of the whole frame: every change of every segment, 0 if none ever change."""
+        interval = 0
+        for segment in plan.segments:
+            interval = math.gcd(interval, self.change_interval(segment, fps))
+        return interval
+
+    @staticmethod
+    def bit_mask(value, length):
+        if not isinstance(value, str):
+            return (False,) * length
+        return tuple(bit == '1' for bit in value[:length].ljust(length, '0'))
+
+    def select(self, buf, segment, bits, color, bg_color):
+        start = segment.start * self.frame.bpp
+        buf[start:start+segment.length*self.frame.bpp] = b''.join([color if bit else bg_color for bit in bits])
+
+    def fill_segment(self, buf, segment, color):
+        start, bpp = segment.start * self.frame.bpp, self.frame.bpp
+        buf[start:start+segment.length*bpp] = color * segment.length
+        return start, bpp
+
+    def render_chase(self, buf, segment, step):
+        start, bpp = self.fill_segment(buf, segment, segment.wire_bg_color)
+        index = start + (step // 3) % segment.length * bpp
+        buf[index:index+bpp] = segment.wire_color
+
+    def render_progress(self, buf, segment, step):
+        length = segment.length
+        lit = max(0, min(segment.progress + 1, length))
+        start = segment.start * self.frame.bpp
+        buf[start:start+length*self.frame.bpp] = segment.wire_color * lit + segment.wire_bg_color * (length - lit)
+
+    def render_fade(self, buf, segment, step):
+        self.fill_segment(buf, segment, segment.wire_fade_color)
+
+    def render_output(self, buf, segment, step):
+        self.select(buf, segment, segment.bits, segment.wire_color, segment.wire_bg_color)
+
+    def render_blink(self, buf, segment, step):
+        start, bpp = self.fill_segment(buf, segment, segment.wire_color)
+        index = start + step % segment.length * bpp
+        buf[index:index+bpp] = bytes(bpp)
+
+    def render_blend(self, buf, segment, step):
+        blend_color, bg_color = segment.table[step]
+        self.select(buf, segment, segment.bits, blend_color, bg_color)
+
+    def render_breathe(self, buf, segment, step):
+        breathe_color, breathe_bg_color = segment.table[step]
+        self.select(buf, segment, segment.bits, breathe_color, breathe_bg_color)
+
+    def render_rainbow(self, buf, segment, step):
+        wheel, bpp = segment.table, self.frame.bpp
+        start = segment.start * bpp
+        buf[start:start+segment.length*bpp] = b''.join([
+            wheel[(offset + step) % 255] for offset in self.wheel_offsets[:segment.length]])
+
+    def render_file(self, buf, segment, step):
+        # Pixels past the end of the animation show bg_color
+        self.fill_segment(buf, segment, segment.wire_bg_color)
+        self.play_frame(segment)
+
+    def play_frame(self, segment):
+        """Copy the animation's current frame into the segment, by the clock rather than the effect step."""
+        animation = segment.table.animation
+        frame = segment.table.current_frame(time.monotonic())
+        pixels = min(segment.length, animation.led_count)
+        self.frame.write_pixels(segment.start, frame[:pixels * animation.bpp], animation.positions, animation.bpp)
+
+class NumpyFrameRenderer(FrameRenderer):
+    """Render whole segments at once through an (N,bpp) uint8 array view of the FrameBuffer."""
+
+    @staticmethod
+    def available():
+        return bool(load_numpy())
+
+    def __init__(self, frame, breathe_factors, animation_dir=None):
+        super().__init__(frame, breathe_factors, animation_dir)
+        self.wire = np.frombuffer(frame.buf, dtype=np.uint8).reshape(frame.led_count, frame.bpp)
+        self.indexes = np.arange(frame.led_count)
+        self.wheel_offsets = np.array(self.wheel_offsets)
+
+    def render(self, plan, step):
+        """Render a full frame for the given effect step into the frame buffer."""
+        wire = self.wire
+        wire[:] = 0
+        for segment in plan.segments:
+            segment.render(wire[segment.start:segment.start+segment.length], segment, step)
+
+    def encode(self, color, palette=None):
+        return np.frombuffer(self.frame.encode(color, palette and palette.scale), dtype=np.uint8)
+
+    def wheel_table(self, palette=None):
+        return np.frombuffer(b''.join((palette or self.frame).wheel), dtype=np.uint8).reshape(-1, self.frame.bpp)
+
+    @staticmethod
+    def bit_mask(value, length):
+        if not isinstance(value, str):
+            return np.zeros(length, dtype=bool)
+        return np.frombuffer(value[:length].ljust(length, '0').encode(), dtype=np.uint8) == BIT_ONE
+
+    def select_mask(self, out, mask, color, bg_color):
+        out[:] = bg_color
+        out[mask] = color
+
+    def render_chase(self, out, segment, step):
+        out[:] = segment.wire_bg_color
+        out[(step // 3) % segment.length] = segment.wire_color
+
+    def render_progress(self, out, segment, step):
+        self.select_mask(out, self.indexes[:segment.length] <= segment.progress, segment.wire_color, segment.wire_bg_color)
+
+    def render_fade(self, out, segment, step):
+        out[:] = segment.wire_fade_color
+
+    def render_output(self, out, segment, step):
+        self.select_mask(out, segment.bits, segment.wire_color, segment.wire_bg_color)
+
+    def render_blink(self, out, segment, step):
+        out[:] = segment.wire_color
+        out[step % segment.length] = 0
+
+    def render_blend(self, out, segment, step):
+        blend_color, bg_color = segment.table[step]
+        self.select_mask(out, segment.bits, blend_color, bg_color)
+
+    def render_breathe(self, out, segment, step):
+        breathe_color, breathe_bg_color = segment.table[step]
+        self.select_mask(out, segment.bits, breathe_color, breathe_bg_color)
+
+    def render_rainbow(self, out, segment, step):
+        out[:] = segment.table[(self.wheel_offsets[:segment.length] + step) % 255]
+
+    def render_file(self, out, segment, step):
+        out[:] = segment.wire_bg_color
+        self.play_frame(segment)
@@ -4,6 +4,11 @@ import os
 import threading
 from skylight.effects_thread import EffectsThread
 from skylight.color_utils import ColorUtils
+from skylight.cycle_cache import CycleCache
+from skylight.frame_buffer import FrameBuffer
+from skylight.frame_renderer import FrameRenderer, NumpyFrameRenderer
+from skylight.metrics import RenderMetrics
+from skylight.render_plan import RenderPlan
 import time
 try:
     import neopixel
@@ -19,28 +24,69 @@ except ImportError:
     import skylight.board_stub as board
 
 class LEDController:
-    def __init__(self, led_count=30, led_pin=board.D18, led_brightness=0.25, led_order=neopixel.GRB):
-        self.strip = neopixel.NeoPixel(led_pin, led_count, brightness=led_brightness, auto_write=False, pixel_order=led_order)
-        self.pixels = [(0, 0, 0)] * led_count
+    def __init__(self, led_count=30, led_pin=board.D18, led_brightness=0.25, led_order=neopixel.GRB, use_numpy=True, fps=30,
+                 raw_timeout=2.0, boot_color=None, max_fps=None, min_fps=1, animation_dir=None):
+        # Brightness is baked into the frame buffer, the strip itself always runs at full brightness
+        self.strip = neopixel.NeoPixel(led_pin, led_count, brightness=1.0, auto_write=False, pixel_order=led_order)
+        self.neopixel_write = getattr(neopixel, 'neopixel_write', None)
+        self.frame = FrameBuffer(led_count, led_order, led_brightness)
+        if boot_color is not None:
+            # Light the strip as a sign of life before the renderer and effects thread are set up
+            self.frame.fill(ColorUtils.get_color(boot_color))
+            self.frame.show(self.strip, self.neopixel_write)
+            self.boot_time = time.monotonic()
+        self.show_callbacks = []
         self.fill_color = (0, 0, 0)
         self.effect_name = None
-        self.effects_thread = EffectsThread(update_interval=1/15)
+        # Frames are rendered only as often as the plan changes, between min_fps and max_fps
+        self.effects_thread = EffectsThread(fps=fps, max_fps=max_fps, min_fps=min_fps)
         self.running = False
+        # lock guards the frame buffer and strip for one frame at a time. Writers of the render state
+        # serialize on state_lock only and publish a new plan, so they never wait for a frame in progress.
         self.lock = threading.Lock()
+        self.state_lock = threading.Lock()
         self.effect_step = 0
+        self.skipped_writes = 0
+        # Streamed raw frames override the effects until raw_timeout seconds after the last one
+        self.raw_timeout = raw_timeout
+        self.raw_until = 0
+        self.metrics = RenderMetrics()
+        # (plan, time.monotonic()) of the last status event, until a frame of that plan is rendered.
+        # event_lock orders note_event against the effects loop marking rendered_plan.
+        self.plan_event = None
+        self.rendered_plan = None
+        self.event_lock = threading.Lock()
 
-        self.data_fields = []
-        self.data_values = []
         self.led_count = led_count
         self.brightness = led_brightness
 
         # Precompute breathe factor for 256 steps
         self.breath_percent = bc = 0.50
         self.num_steps = num = 256
-        self.breathe_factors = [1 - (bc/2) + (bc/2) * math.sin(4 * math.pi * i / num) for i in range(num)]
+        self.breathe_factors = tuple(1 - (bc/2) + (bc/2) * math.sin(4 * math.pi * i / num) for i in range(num))
+        # Render whole segments with numpy when it is installed, otherwise with list slices
+        if use_numpy and NumpyFrameRenderer.available():
+            self.renderer = NumpyFrameRenderer(self.frame, self.breathe_factors, animation_dir)
+        else:
+            self.renderer = FrameRenderer(self.frame, self.breathe_factors, animation_dir)
+        self.plan = RenderPlan()
+        self.interval_plan = None
+        self.interval = 1
+        # Periodic plans are rendered once per cycle and replayed, a new plan starts a new cycle
+        self.cycle_cache = CycleCache(self.renderer, self.num_steps)
+        self.set_brightness(led_brightness)
+        # The boot frame stays on the strip until the first data fields replace this empty plan
+        self.boot_plan = self.plan if boot_color is not None else None
         # Set the default effect to effects_loop
         self.set_effect(self.effects_loop)
-        self.set_brightness(led_brightness)
+
+    @property
+    def data_fields(self):
+        return self.plan.data_fields
+
+    @property
+    def data_values(self):
+        return self.plan.data_values
 
     def add_color(self, name, rgb):
         """Add a new color to the dictionary."""
@@ -55,67 +101,163 @@ class LEDController:
         return ColorUtils.get_color(color)
 
     def get_pixels(self):
-        with self.lock:
-            return self.pixels
+        """Read-only view of the frame buffer: wire ordered bytes with brightness applied."""
+        return self.frame.view()
+
+    def get_pixel_format(self):
+        """Wire positions of r, g, b and bytes per pixel of the buffer returned by get_pixels."""
+        return self.frame.positions, self.frame.bpp
 
     def show_strip(self):
         #with self.lock:
-        self.strip.show()
-        self.pixels = ColorUtils.scale_pixels(self.pixels, self.brightness)
+        self.frame.show(self.strip, self.neopixel_write)
+        for callback in self.show_callbacks:
+            callback(self.frame.buf)
+
+    def add_show_callback(self, callback):
+        """Call callback(buf) with the frame buffer now and every time a frame is sent to the strip."""
+        with self.lock:
+            # Replaced rather than changed in place, the effects thread may be walking the old list
+            self.show_callbacks = self.show_callbacks + [callback]
+            callback(self.frame.buf)
+
+    def remove_show_callback(self, callback):
+        with self.lock:
+            self.show_callbacks = [other for other in self.show_callbacks if other != callback]
 
     def set_data_fields(self, init_data_fields):
-        #with self.lock:
         if init_data_fields:
-            self.data_fields = []
-            self.data_values = []
-            start = 0
-            for field in init_data_fields:
-                mode, value, length, color, bg_color, pad = field
-                if isinstance(length, int):
-                    mode = "chase" if not isinstance(mode, str) else mode
-                    value = self.process_value(value, length, mode)
-                    color, bg_color = self.get_color(color), self.get_color(bg_color)
-                    pad = 0 if not isinstance(pad, int) else pad
-                    start += length + pad
-                    if start <= self.led_count:
-                        self.data_fields.append((mode, length, color, bg_color, pad))
-                        self.data_values.append(value)
+            data_fields, data_values = self.parse_data_fields(init_data_fields)
+            with self.state_lock:
+                self.publish(RenderPlan.compile(data_fields, data_values, self.renderer))
+
+    def parse_data_fields(self, init_data_fields):
+        data_fields = []
+        data_values = []
+        start = 0
+        for field in init_data_fields:
+            mode, value, length, color, bg_color, pad = field
+            if isinstance(length, int):
+                mode = "chase" if not isinstance(mode, str) else mode
+                value = self.process_value(value, length, mode)
+                color, bg_color = self.get_color(color), self.get_color(bg_color)
+                pad = 0 if not isinstance(pad, int) else pad
+                start += length + pad
+                if start <= self.led_count:
+                    data_fields.append((mode, length, color, bg_color, pad))
+                    data_values.append(value)
+        return data_fields, data_values
+
+    def update_data_values(self, data_fields, data_values, new_values):
+        data_values = list(data_values)
+        for i, value in enumerate(new_values):
+            mode, length, _, _, _ = data_fields[i]
+            if mode == 'file' and not isinstance(value, str):
+                # A file played over a field keeps playing through the values sent for the whole layout
+                continue
+            data_values[i] = self.process_value(value, length, mode)
+        return data_values
 
     def set_data_values(self, new_values):
-        with self.lock:
-            for i, value in enumerate(new_values):
-                mode, length, _, _, _ = self.data_fields[i]
-                self.data_values[i] = self.process_value(value, length, mode)
+        with self.state_lock:
+            data_values = self.update_data_values(self.plan.data_fields, self.plan.data_values, new_values)
+            self.publish(RenderPlan.compile(self.plan.data_fields, data_values, self.renderer))
+
+    def play_file(self, path, index=None):
+        """Play the animation file at path over data field index, or over the whole strip without one."""
+        with self.state_lock:
+            if index is None:
+                start = 0
+                data_fields, data_values = [("file", self.led_count, (0, 0, 0), (0, 0, 0), 0)], [path]
+            else:
+                data_fields, data_values = list(self.plan.data_fields), list(self.plan.data_values)
+                if not 0 <= index < len(data_fields):
+                    raise ValueError(f"No data field {index}")
+                _, length, color, bg_color, pad = data_fields[index]
+                data_fields[index] = ("file", length, color, bg_color, pad)
+                data_values[index] = path
+                start = sum(field[1] + field[4] for field in data_fields[:index])
+            # Playing a file again starts it over, the other file segments keep playing
+            self.publish(RenderPlan.compile(data_fields, data_values, self.renderer, restart={start}))
 
     def set_brightness(self, brightness):
-        with self.lock:
-            self.brightness = brightness
-            self.strip.brightness = brightness
-            self.show_strip()
+        with self.state_lock:
+            # Wire colors in the plan have brightness applied, recompile them for the next frame
+            palette = self.frame.palette(brightness)
+            plan = RenderPlan.compile(self.plan.data_fields, self.plan.data_values, self.renderer, palette)
+            self.apply_brightness(palette)
+            self.publish(plan)
+
+    def apply_brightness(self, palette):
+        """Make palette the frame's brightness, called with state_lock held once the plan using it compiled."""
+        self.brightness = palette.brightness
+        self.frame.set_brightness(palette.brightness, palette)
+
+    def apply_batch(self, commands):
+        """Apply a list of (action, params) render state commands and publish them as one plan.
+
+        The effects loop reads the plan once per frame, so every command in the batch shows in the same frame.
+        Supported actions are set_data_fields, set_data_values and set_brightness.
+        """
+        with self.state_lock:
+            data_fields, data_values = self.plan.data_fields, self.plan.data_values
+            brightness = None
+            for action, params in commands:
+                if action == "set_data_fields":
+                    if params:
+                        data_fields, data_values = self.parse_data_fields(params)
+                elif action == "set_data_values":
+                    data_values = self.update_data_values(data_fields, data_values, params)
+                elif action == "set_brightness":
+                    brightness = float(params)
+                else:
+                    raise ValueError(f"Action not allowed in a batch: {action}")
+            # Nothing is applied until every command in the batch was accepted and the plan compiled
+            palette = self.frame.palette(brightness) if brightness is not None else None
+            plan = RenderPlan.compile(data_fields, data_values, self.renderer, palette)
+            if palette:
+                self.apply_brightness(palette)
+            self.publish(plan)
+
+    def publish(self, plan):
+        """Make plan the render state of the next frame, called with state_lock held."""
+        self.plan = plan
+        self.renderer.keep_playbacks(plan)
+        self.effects_thread.wake()
 
     def set_color(self, color, index=None):
         color = self.get_color(color)
-        scaled_color = ColorUtils.scale_color(color, self.brightness)
-        #with self.lock:
+        self.renderer.invalidate()
+        self.effects_thread.wake()
         if index is not None and index < self.led_count:
-            self.pixels[index] = scaled_color
-            self.strip[index] = color
+            self.frame.set_pixel(index, color)
         else:
-            self.pixels = [scaled_color] * self.led_count
-            self.strip.fill(color)
+            self.frame.fill(color)
 
     def select_color(self, condition, color, bg_color, index):
         self.set_color(color if condition else bg_color, index)
 
     def clear(self):
         """Clear the LED strip."""
-        self.set_color((0, 0, 0))
-        self.show_strip()
+        self.fill((0, 0, 0))
 
     def fill(self, color):
         """Fill the LED strip with a specific color."""
-        self.set_color(color)
-        self.show_strip()
+        with self.lock:
+            self.set_color(color)
+            self.show_strip()
+
+    def set_raw_frame(self, index, data, push=True):
+        """Write streamed r, g, b bytes from pixel index over the effects, and show them on push."""
+        with self.lock:
+            self.frame.write_rgb(index, data)
+            starting = not self.raw_until
+            self.raw_until = time.monotonic() + self.raw_timeout
+            if push:
+                self.show_strip()
+        if starting:
+            # A static plan may sleep until woken, the effects loop schedules the check for the stream timeout
+            self.effects_thread.wake()
 
     def start_effects(self, effect_function, **params):
         self.effect_name = effect_function.__name__
@@ -147,54 +289,100 @@ class LEDController:
             "led_count": self.led_count,
             "color": self.fill_color,
             "brightness": self.brightness,
-            "current_effect": self.effect_name
+            "current_effect": self.effect_name,
+            "skipped_writes": self.skipped_writes,
+            "raw_active": self.raw_until > time.monotonic(),
+            "effective_fps": self.effects_thread.scheduler.effective_fps(),
+            "frame_stats": self.effects_thread.scheduler.get_stats(),
+            "cycle_cache": self.cycle_cache.get_stats(),
+            "animations": {path: animation.get_state() for path, animation in self.renderer.animations.items()}
         }
 
+    def note_event(self, event_time):
+        """The render state just published shows a status event received at event_time (time.monotonic)."""
+        with self.event_lock:
+            if self.rendered_plan is self.plan:
+                # The effects thread already rendered it, which is common when this call comes over a pipe
+                self.metrics.event_to_photon.observe(time.monotonic() - event_time)
+            else:
+                self.plan_event = (self.plan, event_time)
+
+    def get_metrics(self):
+        scheduler = self.effects_thread.scheduler
+        metrics = self.metrics.get_stats()
+        metrics["target_fps"] = scheduler.fps
+        metrics["overruns"] = scheduler.overruns
+        metrics["skipped_frames"] = scheduler.skipped_frames
+        metrics["skipped_writes"] = self.skipped_writes
+        return metrics
+
     def effects_loop(self):
-        #print ('effects_loop')
-        sleep_time = 0.010
+        """Render exactly one frame and show it if it changed, the effects thread schedules the next one.
+
+        Returns the number of frames until the strip changes again, for the effects thread to sleep.
+        """
+        metrics = self.metrics
+        wait_start = time.perf_counter()
         with self.lock:
-            for count in range(self.led_count):
-                self.effect_step = (self.effect_step + 1) % self.num_steps
-                breathe_factor = self.breathe_factors[self.effect_step]
-                start = 0
-                self.set_color("black")
-                for i, value in enumerate(self.data_values):
-                    mode, length, color, bg_color, pad = self.data_fields[i]
-                    #if mode == 'breathe':
-                    #    print(f'breath_factor = {breathe_factor}')
-                    progress = int(length * value) if isinstance(value, float) else 0
-                    fade_color = ColorUtils.blend_colors(color, bg_color, value) if isinstance(value, float) else color
-                    blend_color = ColorUtils.blend_colors(color, bg_color, breathe_factor)
-                    breathe_color = ColorUtils.blend_colors((0, 0, 0), color, breathe_factor)
-                    breathe_bg_color = ColorUtils.blend_colors((0, 0, 0), bg_color, breathe_factor)
-                    for index in range(length):
-                        self.apply_mode(mode, self.effect_step, index, length, start+index, progress, color, bg_color, fade_color, blend_color, breathe_color, breathe_bg_color, value)
-                    start += length + pad
+            render_start = time.perf_counter()
+            metrics.lock_wait.observe(render_start - wait_start)
+            if self.raw_until:
+                remaining = self.raw_until - time.monotonic()
+                if remaining > 0:
+                    # Look again when the stream would time out
+                    return max(1, math.ceil(remaining * self.effects_thread.scheduler.fps))
+                # The stream stopped, the strip shows its last frame until the effects draw over it
+                self.raw_until = 0
+                self.renderer.invalidate()
+            # The plan is read once per frame, a plan published meanwhile is picked up on the next frame
+            plan = self.plan
+            if plan is self.boot_plan:
+                return 0
+            self.effect_step = self.effects_thread.scheduler.frame % self.num_steps
+            changed = self.render_frame(self.effect_step, plan)
+            show_start = time.perf_counter()
+            metrics.render_time.observe(show_start - render_start)
+            if changed:
                 self.show_strip()
-                time.sleep(sleep_time)
-
-    def apply_mode(self, mode, step, index, length, offset_index, progress, color, bg_color, fade_color, blend_color, breathe_color, breathe_bg_color, value):
-        if mode == "chase":
-            self.select_color((int(step/3) - index) % length == 0, color, bg_color, offset_index)
-        elif mode == "progress":
-            self.select_color(progress >= index, color, bg_color, offset_index)
-        elif mode == "fade":
-            self.set_color(fade_color, offset_index)
-        elif mode == "output":
-            self.select_color(value[index] == '1', color, bg_color, offset_index)
-        elif mode == "blink":
-            self.set_color("black" if (step - index) % length == 0 else color, offset_index)
-        elif mode == "blend":
-            self.select_color(value[index] == '1', blend_color, bg_color, offset_index)
-        elif mode == "breathe":
-            self.select_color(value[index] == '1', breathe_color, breathe_bg_color, offset_index)
-        elif mode == "rainbow":
-            # need to be tested
-            pos = (index * 256 // self.led_count) + step
-            self.set_color(ColorUtils.wheel(pos), offset_index)
+                metrics.show_time.observe(time.perf_counter() - show_start)
+            else:
+                self.skipped_writes += 1
+            now = time.monotonic()
+            metrics.frame_rate.mark(now)
+            if changed:
+                metrics.show_rate.mark(now)
+            with self.event_lock:
+                self.rendered_plan = plan
+                plan_event = self.plan_event
+                if plan_event is not None and plan_event[0] is plan:
+                    # An unchanged frame counts too, the strip already shows the event
+                    metrics.event_to_photon.observe(now - plan_event[1])
+                    self.plan_event = None
+            # Frames until the plan changes the strip again, 0 sleeps until the next state change
+            if plan is not self.interval_plan:
+                self.interval_plan = plan
+                self.interval = self.renderer.plan_interval(plan, self.effects_thread.scheduler.fps)
+            return self.interval
+
+    def set_fps(self, fps):
+        self.effects_thread.scheduler.set_fps(fps)
+        # File segments step at a rate that depends on fps
+        self.interval_plan = None
+        self.effects_thread.wake()
+
+    def set_fps_limits(self, max_fps=None, min_fps=1):
+        self.effects_thread.scheduler.set_limits(max_fps, min_fps)
+        self.effects_thread.wake()
+
+    def render_frame(self, step, plan=None):
+        """Render the plan into the frame buffer. Returns False if the frame did not change."""
+        self.cycle_cache.render(plan if plan is not None else self.plan, step)
+        return self.renderer.changed()
 
     def process_value(self, value, length, mode):
+        if mode == 'file':
+            # The path of the animation file
+            return value
         if isinstance(value, str):
             return value.ljust(length, '0')
         if mode in ['breathe', 'blend']:
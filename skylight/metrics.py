@@ -0,0 +1,171 @@
+import asyncio
+import bisect
+import time
+
+# Bucket upper bounds in seconds, for work done once per frame
+TIME_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25)
+# Bucket upper bounds in seconds, for delays between a printer event and the leds showing it
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class Histogram:
+    """Counts of observed values per bucket, cheap enough to update on every frame."""
+
+    def __init__(self, buckets=TIME_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q quantile, never more than the largest value seen."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def rounded_quantile(self, q):
+        value = self.quantile(q)
+        return None if value is None else round(value, 6)
+
+    def get_stats(self):
+        cumulative = []
+        seen = 0
+        for count in self.counts[:-1]:
+            seen += count
+            cumulative.append(seen)
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 6),
+            "max": round(self.max, 6),
+            "p50": self.rounded_quantile(0.5),
+            "p99": self.rounded_quantile(0.99),
+            "buckets": list(zip(self.buckets, cumulative)),
+        }
+
+class Rate:
+    """Events per second, from an exponentially weighted average of the intervals between events."""
+
+    def __init__(self, weight=0.1):
+        self.weight = weight
+        self.interval = None
+        self.last = None
+
+    def mark(self, now):
+        if self.last is not None:
+            interval = now - self.last
+            if self.interval is None:
+                self.interval = interval
+            else:
+                self.interval += self.weight * (interval - self.interval)
+        self.last = now
+
+    def get_rate(self):
+        if not self.interval:
+            return 0.0
+        # Falls off while no events arrive instead of reporting the last rate forever
+        return round(1.0 / max(self.interval, time.monotonic() - self.last), 2)
+
+class RenderMetrics:
+    """Timings of the render loop, updated by the effects thread without taking any lock."""
+
+    def __init__(self):
+        self.lock_wait = Histogram()
+        self.render_time = Histogram()
+        self.show_time = Histogram()
+        self.event_to_photon = Histogram(LATENCY_BUCKETS)
+        self.frame_rate = Rate()
+        self.show_rate = Rate()
+
+    def get_stats(self):
+        return {
+            "fps": self.frame_rate.get_rate(),
+            "show_fps": self.show_rate.get_rate(),
+            "lock_wait": self.lock_wait.get_stats(),
+            "render_time": self.render_time.get_stats(),
+            "show_time": self.show_time.get_stats(),
+            "event_to_photon": self.event_to_photon.get_stats(),
+        }
+
+class PhaseTimer:
+    """Seconds spent in each named phase of a sequence, such as service startup."""
+
+    def __init__(self, start=None):
+        self.start = time.monotonic() if start is None else start
+        self.last = self.start
+        self.phases = {}
+        self.events = {}
+
+    def mark(self, phase):
+        """End phase now, the next phase starts where this one ended."""
+        now = time.monotonic()
+        self.phases[phase] = round(now - self.last, 4)
+        self.last = now
+
+    def at(self, event, when):
+        """Record that event happened at time.monotonic() when, reported as seconds since the start."""
+        self.events[event] = round(when - self.start, 4)
+
+    def get_stats(self):
+        return dict(self.phases, **self.events, total=round(self.last - self.start, 4))
+
+def prometheus_text(metrics, prefix="skylight"):
+    """Format nested metrics in the Prometheus text exposition format.
+
+    Keys are joined into metric names, histograms (dicts with buckets) become Prometheus histograms,
+    numbers become gauges, and the entries of a "printers" dict get a printer label.
+    """
+    lines = []
+
+    def add(name, value, labels):
+        if isinstance(value, dict):
+            if "buckets" in value:
+                for bound, count in value["buckets"]:
+                    lines.append(f'{name}_bucket{{{labels}le="{bound}"}} {count}')
+                lines.append(f'{name}_bucket{{{labels}le="+Inf"}} {value["count"]}')
+                lines.append(f'{name}_sum{{{labels.rstrip(",")}}} {value["sum"]}')
+                lines.append(f'{name}_count{{{labels.rstrip(",")}}} {value["count"]}')
+            elif name.endswith("_printers"):
+                for printer, printer_metrics in value.items():
+                    add(name[:-len("_printers")] + "_printer", printer_metrics, f'{labels}printer="{printer}",')
+            else:
+                for key, item in value.items():
+                    add(f"{name}_{key}", item, labels)
+        elif isinstance(value, bool):
+            lines.append(f'{name}{{{labels.rstrip(",")}}} {int(value)}')
+        elif isinstance(value, (int, float)):
+            lines.append(f'{name}{{{labels.rstrip(",")}}} {value}')
+
+    add(prefix, metrics, "")
+    return "\n".join(line.replace("{}", "") for line in lines) + "\n"
+
+async def serve_prometheus(host, port, collect):
+    """Serve prometheus_text(collect()) over HTTP on every request, whatever the path."""
+
+    async def handle(reader, writer):
+        try:
+            # Request line and headers are read and ignored
+            while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                pass
+            body = prometheus_text(collect()).encode()
+            writer.write(b"HTTP/1.0 200 OK\r\nContent-Type: text/plain; version=0.0.4\r\n"
+                         b"Content-Length: %d\r\n\r\n" % len(body) + body)
+            await writer.drain()
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, host, port)
+    async with server:
+        await server.serve_forever()
@@ -0,0 +1,168 @@
+import asyncio
+import json
+import time
+from skylight.metrics import Histogram, Rate
+
+MISSING = object()
+
+class StatusState:
+    """Latest value of every subscribed Moonraker field, merged from partial status updates."""
+
+    def __init__(self):
+        self.status = {}
+        self.version = 0
+        self.event_time = 0
+        self.pending = 0
+        self.first_pending_time = None
+        # (object, field) pairs changed since the last apply
+        self.changed_fields = set()
+
+    def merge(self, status_update, event_time=0):
+        """Merge a partial status update. Returns True if any field changed value."""
+        changed = False
+        for name, fields in (status_update or {}).items():
+            if not isinstance(fields, dict):
+                continue
+            current = self.status.setdefault(name, {})
+            for key, value in fields.items():
+                if current.get(key, MISSING) != value:
+                    current[key] = value
+                    self.changed_fields.add((name, key))
+                    changed = True
+        if event_time:
+            self.event_time = event_time
+        if changed:
+            self.version += 1
+            self.pending += 1
+            if self.first_pending_time is None:
+                self.first_pending_time = time.monotonic()
+        return changed
+
+    def get(self, name, key, default=None):
+        return self.status.get(name, {}).get(key, default)
+
+class IngestPipeline:
+    """Two stage Moonraker ingest.
+
+    read() decodes messages as fast as they arrive and merges status deltas into a StatusState.
+    consume() applies the merged state when it changed, at most once per min_interval, and at least
+    once per refresh_interval, so a burst of updates costs one apply and the last update is never stuck.
+    """
+
+    def __init__(self, apply, min_interval=0.25, refresh_interval=5, debug=False):
+        self.state = StatusState()
+        self.apply = apply
+        self.min_interval = min_interval
+        self.refresh_interval = refresh_interval
+        self.debug = debug
+        self.changed = None
+        self.messages = 0
+        self.skipped_messages = 0
+        self.decode_time = 0.0
+        self.decode_times = Histogram()
+        self.message_rate = Rate()
+        self.applied = 0
+        self.apply_errors = 0
+        self.applied_version = 0
+        self.last_apply_time = 0
+        self.ingest_lag = None
+        self.event_lag = None
+
+    def handle_message(self, message):
+        """Decode one websocket message and merge any status it carries."""
+        self.messages += 1
+        self.message_rate.mark(time.monotonic())
+        # proc stats arrive every second and are only ever printed, don't decode them unless debugging
+        if not self.debug and '"notify_proc_stat_update"' in message:
+            self.skipped_messages += 1
+            return None
+        start = time.perf_counter()
+        response = json.loads(message)
+        decode_time = time.perf_counter() - start
+        self.decode_time += decode_time
+        self.decode_times.observe(decode_time)
+
+        method = response.get("method")
+        if method == "notify_status_update":
+            params = response.get("params", [{}, 0])
+            if self.debug:
+                print(f"receive_updates: status_update = {params}")
+            self.merge(params[0], params[1] if len(params) > 1 else 0)
+        elif response.get("id") == 2:  # ID used for query response
+            query_response = response.get("result", {})
+            if self.debug:
+                print(f"receive_updates: id = {response.get('id')}")
+            self.merge(query_response.get("status", {}), query_response.get("eventtime", 0))
+        elif method == "notify_proc_stat_update":
+            proc_stat = response.get('params', [{}])[0]
+            print(f"CPU Temp = {proc_stat.get('cpu_temp', 0.0) if proc_stat else None}")
+        elif self.debug:
+            print(f"receive updates: {method} = {response.get('params', None)}")
+        return response
+
+    def merge(self, status_update, event_time):
+        if self.state.merge(status_update, event_time) and self.changed:
+            self.changed.set()
+
+    async def read(self, connection):
+        """Reader stage: returns when the connection closes."""
+        async for message in connection:
+            self.handle_message(message)
+
+    async def consume(self):
+        """Consumer stage: apply the latest state on change or on the refresh timer."""
+        self.changed = asyncio.Event()
+        while True:
+            try:
+                await asyncio.wait_for(self.changed.wait(), self.refresh_interval)
+            except asyncio.TimeoutError:
+                pass
+            # Coalesce bursts: everything merged while waiting out min_interval goes into one apply
+            wait = self.min_interval - (time.monotonic() - self.last_apply_time)
+            if wait > 0:
+                await asyncio.sleep(wait)
+            self.changed.clear()
+            self.apply_state()
+
+    def apply_state(self):
+        state = self.state
+        now = time.monotonic()
+        if state.first_pending_time is not None:
+            self.ingest_lag = now - state.first_pending_time
+        if state.version != self.applied_version and state.event_time:
+            # Klipper event times are the printer host's monotonic clock, meaningful when it is this host
+            self.event_lag = now - state.event_time
+        try:
+            self.apply(state)
+        except Exception as e:
+            # One bad update must not stop the consumer, the next change or refresh applies again
+            self.apply_errors += 1
+            print(f"Error applying printer status: {e}")
+        state.pending = 0
+        state.first_pending_time = None
+        state.changed_fields = set()
+        self.applied += 1
+        self.applied_version = state.version
+        self.last_apply_time = now
+
+    def get_stats(self):
+        return {
+            "messages": self.messages,
+            "skipped_messages": self.skipped_messages,
+            "decode_time": round(self.decode_time, 6),
+            "applied": self.applied,
+            "apply_errors": self.apply_errors,
+            "queue_depth": self.state.pending,
+            "ingest_lag": self.ingest_lag,
+            "event_lag": self.event_lag,
+        }
+
+    def get_metrics(self):
+        return {
+            "messages": self.messages,
+            "message_rate": self.message_rate.get_rate(),
+            "decode_time": self.decode_times.get_stats(),
+            "applied": self.applied,
+            "apply_errors": self.apply_errors,
+            "ingest_lag": self.ingest_lag,
+        }
@@ -0,0 +1,282 @@
+# skylight/moonraker_replay.py
+# Record a Moonraker websocket stream, and replay it from a local Moonraker stand-in.
+#
+#   python -m skylight.moonraker_replay record --host voron.local --out print.jsonl
+#   python -m skylight.moonraker_replay serve --file print.jsonl --speed 10
+#   python -m skylight.moonraker_replay serve --synthetic burst --port 7125
+#   python -m skylight.moonraker_replay loadtest --synthetic burst --speed 0 --json results.json
+#
+# Recordings are JSON lines: a header line, then {"t": seconds since the start, "message": raw text}.
+# serve answers the subscribe and query requests of a PrinterConnection and then sends the recorded
+# notifications at their recorded pace divided by --speed, or as fast as possible with --speed 0.
+# loadtest runs the stand-in and a headless SkylightService on the neopixel stand-in together and
+# reports throughput, CPU use and event to LED latency.
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import tempfile
+import time
+
+import websockets
+
+from skylight.display_rules import RuleSet
+from skylight.printer_connection import PrinterConnection
+
+def status_message(status, eventtime):
+    return {"jsonrpc": "2.0", "method": "notify_status_update", "params": [status, eventtime]}
+
+def proc_stat_message(cpu_temp):
+    return {"jsonrpc": "2.0", "method": "notify_proc_stat_update",
+            "params": [{"cpu_temp": cpu_temp, "system_cpu_usage": {"cpu": 12.5}}]}
+
+def synthetic_print(duration=60, heat_time=15, rate=4):
+    """A print: the extruder heats up, then progress climbs to complete, temperatures reported rate times a second."""
+    events = [(0, status_message({"extruder": {"temperature": 25.0, "target": 215.0},
+                                  "print_stats": {"state": "printing"},
+                                  "display_status": {"progress": 0.0}}, 0))]
+    steps = int(duration * rate)
+    for step in range(1, steps + 1):
+        t = step / rate
+        heat = min(t / heat_time, 1.0)
+        status = {"extruder": {"temperature": round(25 + 190 * heat + random.uniform(-0.5, 0.5), 2)}}
+        if t > heat_time:
+            status["display_status"] = {"progress": round((t - heat_time) / (duration - heat_time), 4)}
+        events.append((t, status_message(status, t)))
+        if step % rate == 0:
+            events.append((t, proc_stat_message(45 + random.uniform(0, 2))))
+    events.append((duration, status_message({"print_stats": {"state": "complete"},
+                                             "extruder": {"target": 0.0}}, duration)))
+    return events
+
+def synthetic_burst(duration=60, every=2.0, burst=200, burst_time=0.05):
+    """A print interrupted by bursts of status updates, as object exclusion or fast sensor reports cause."""
+    events = synthetic_print(duration)
+    t = every
+    while t < duration:
+        for i in range(burst):
+            at = t + burst_time * i / burst
+            events.append((at, status_message({"extruder": {"temperature": round(215 + random.uniform(-2, 2), 2)},
+                                               "display_status": {"progress": round(t / duration, 4)}}, at)))
+        t += every
+    events.sort(key=lambda event: event[0])
+    return events
+
+SYNTHETIC = {
+    "print": synthetic_print,
+    "burst": synthetic_burst,
+}
+
+def load_recording(path):
+    """Return (initial status, [(t, message)]) from a recording made by record()."""
+    initial = {}
+    events = []
+    with open(path) as file:
+        for line in file:
+            entry = json.loads(line)
+            if "message" not in entry:
+                continue
+            message = json.loads(entry["message"])
+            if "id" in message:
+                # Answers to the recorder's own subscribe and query requests hold the status at the start
+                initial.update(message.get("result", {}).get("status", {}))
+            else:
+                events.append((entry["t"], message))
+    return initial, events
+
+async def record(host, port, path, duration=None, extra_fields=()):
+    """Subscribe like a PrinterConnection and write every message received to path."""
+    objects = RuleSet.default().objects(PrinterConnection.status_fields)
+    for field in extra_fields:
+        name, _, key = field.rpartition('.')
+        objects.setdefault(name, []).append(key)
+    async with websockets.connect(f"ws://{host}:{port}/websocket") as connection:
+        start = time.monotonic()
+        with open(path, "w") as file:
+            file.write(json.dumps({"recording": 1, "host": host, "started": time.time(), "objects": objects}) + "\n")
+            for request_id, method in ((1, "printer.objects.subscribe"), (2, "printer.objects.query")):
+                await connection.send(json.dumps({"jsonrpc": "2.0", "method": method,
+                                                  "params": {"objects": objects}, "id": request_id}))
+            count = 0
+            try:
+                while duration is None or time.monotonic() - start < duration:
+                    timeout = None if duration is None else duration - (time.monotonic() - start)
+                    message = await asyncio.wait_for(connection.recv(), timeout)
+                    file.write(json.dumps({"t": round(time.monotonic() - start, 6), "message": message}) + "\n")
+                    count += 1
+            except (asyncio.TimeoutError, websockets.exceptions.ConnectionClosed):
+                pass
+    print(f"Recorded {count} messages to {path}")
+
+class MoonrakerStandIn:
+    """A websocket server that answers like Moonraker and replays status notifications to every client.
+
+    Event times in replayed status updates are rewritten to this host's monotonic clock, which is what
+    Klipper sends when it runs on the same host, so the service's event lag stays meaningful.
+    """
+
+    def __init__(self, events, initial=None, speed=1.0, loop=False):
+        self.events = events
+        self.initial = initial or {}
+        self.speed = speed
+        self.loop = loop
+        self.sent = 0
+        self.finished = asyncio.Event()
+        self.port = None
+
+    async def handler(self, websocket, path=None):
+        status = json.loads(json.dumps(self.initial))
+        replay = None
+        try:
+            async for message in websocket:
+                request = json.loads(message)
+                if request.get("method") in ("printer.objects.subscribe", "printer.objects.query"):
+                    await websocket.send(json.dumps({"jsonrpc": "2.0", "id": request.get("id"),
+                                                     "result": {"eventtime": time.monotonic(), "status": status}}))
+                    if replay is None:
+                        replay = asyncio.ensure_future(self.replay(websocket))
+        except websockets.exceptions.ConnectionClosed:
+            pass
+        finally:
+            if replay is not None:
+                replay.cancel()
+
+    async def replay(self, websocket):
+        while True:
+            start = time.monotonic()
+            for sent, (t, message) in enumerate(self.events):
+                if self.speed:
+                    delay = start + t / self.speed - time.monotonic()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                elif sent % 100 == 0:
+                    # Unbounded speed still lets the rest of the loop run now and then
+                    await asyncio.sleep(0)
+                if message.get("method") == "notify_status_update":
+                    message = dict(message, params=[message["params"][0], time.monotonic()])
+                await websocket.send(json.dumps(message))
+                self.sent += 1
+            if not self.loop:
+                break
+        self.finished.set()
+
+    async def serve(self, host="localhost", port=7125):
+        async with websockets.serve(self.handler, host, port) as server:
+            self.port = next(iter(server.sockets)).getsockname()[1]
+            await asyncio.Future()
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("localhost", 0))
+        return sock.getsockname()[1]
+
+def write_loadtest_config(path, moonraker_port, led_count, fps):
+    with open(path, "w") as file:
+        file.write("[skylight]\n"
+                   f"skylight_port = {free_port()}\n"
+                   f"led_count = {led_count}\n"
+                   f"fps = {fps}\n"
+                   f"moonraker_port = {moonraker_port}\n")
+
+async def loadtest(events, initial, speed, duration, led_count, fps):
+    """Replay events to a headless SkylightService and return its throughput and latency."""
+    # Imported here so record and serve work without the led modules
+    import skylight.neopixel_stub as neopixel_stub
+    from skylight import led_controller
+    import skylight_main
+
+    led_controller.neopixel = neopixel_stub
+    stand_in = MoonrakerStandIn(events, initial, speed)
+    stand_in_task = asyncio.ensure_future(stand_in.serve("localhost", 0))
+    while stand_in.port is None:
+        await asyncio.sleep(0.01)
+
+    with tempfile.TemporaryDirectory() as directory:
+        config_file = os.path.join(directory, "skylight.conf")
+        write_loadtest_config(config_file, stand_in.port, led_count, fps)
+        service = skylight_main.SkylightService(config_file)
+    neopixel_stub.writes.reset()
+    wall_start, cpu_start = time.monotonic(), time.process_time()
+    service_task = asyncio.ensure_future(service.serve())
+    try:
+        await asyncio.wait_for(stand_in.finished.wait(), duration)
+        # Let the last updates reach the strip
+        await asyncio.sleep(service.min_update_interval + 2.0 / fps)
+    except asyncio.TimeoutError:
+        pass
+    wall, cpu = time.monotonic() - wall_start, time.process_time() - cpu_start
+    metrics = service.get_metrics()
+    service_task.cancel()
+    stand_in_task.cancel()
+    service.led_controller.stop()
+
+    render = metrics["render"]
+    ingest = next(iter(metrics["printers"].values()))
+    return {
+        "messages_sent": stand_in.sent,
+        "messages_received": ingest["messages"],
+        "messages_per_second": round(ingest["messages"] / wall, 1),
+        "applied": ingest["applied"],
+        "cpu_percent": round(100 * cpu / wall, 1),
+        "event_to_photon_p50": render["event_to_photon"]["p50"],
+        "event_to_photon_p99": render["event_to_photon"]["p99"],
+        "event_to_photon_max": render["event_to_photon"]["max"],
+        "render_fps": render["fps"],
+        "render_p99": render["render_time"]["p99"],
+        "writes": neopixel_stub.writes.count,
+        "seconds": round(wall, 2),
+    }
+
+def load_events(args):
+    if args.file:
+        return load_recording(args.file)
+    return {}, SYNTHETIC[args.synthetic](args.length)
+
+def main():
+    parser = argparse.ArgumentParser(description="Record and replay Moonraker status streams")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    record_parser = commands.add_parser("record", help="record a Moonraker stream to a file")
+    record_parser.add_argument("--host", default="localhost")
+    record_parser.add_argument("--port", type=int, default=7125)
+    record_parser.add_argument("--out", required=True)
+    record_parser.add_argument("--duration", type=float, help="seconds to record, until the connection closes if unset")
+    record_parser.add_argument("--extra-fields", default="", help="more fields to subscribe to, e.g. heater_bed.temperature")
+
+    for name, help_text in (("serve", "run a Moonraker stand-in"), ("loadtest", "replay to a headless service")):
+        command = commands.add_parser(name, help=help_text)
+        source = command.add_mutually_exclusive_group()
+        source.add_argument("--file", help="recording to replay")
+        source.add_argument("--synthetic", choices=list(SYNTHETIC), default="print")
+        command.add_argument("--length", type=float, default=60, help="seconds of synthetic stream")
+        command.add_argument("--speed", type=float, default=1.0, help="replay speed, 0 for as fast as possible")
+    commands.choices["serve"].add_argument("--host", default="localhost")
+    commands.choices["serve"].add_argument("--port", type=int, default=7125)
+    commands.choices["serve"].add_argument("--loop", action="store_true", help="replay again when the stream ends")
+    loadtest_parser = commands.choices["loadtest"]
+    loadtest_parser.add_argument("--duration", type=float, default=120, help="maximum seconds to run")
+    loadtest_parser.add_argument("--led-count", type=int, default=60)
+    loadtest_parser.add_argument("--fps", type=int, default=30)
+    loadtest_parser.add_argument("--json", help="save the results to this file")
+    args = parser.parse_args()
+
+    if args.command == "record":
+        extra_fields = [field.strip() for field in args.extra_fields.split(",") if field.strip()]
+        asyncio.run(record(args.host, args.port, args.out, args.duration, extra_fields))
+    elif args.command == "serve":
+        initial, events = load_events(args)
+        print(f"Serving {len(events)} messages on ws://{args.host}:{args.port}/websocket at speed {args.speed}")
+        asyncio.run(MoonrakerStandIn(events, initial, args.speed, args.loop).serve(args.host, args.port))
+    else:
+        initial, events = load_events(args)
+        results = asyncio.run(loadtest(events, initial, args.speed, args.duration, args.led_count, args.fps))
+        for key, value in results.items():
+            print(f"{key:<24} {value}")
+        if args.json:
+            with open(args.json, "w") as file:
+                json.dump(results, file, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+# In-memory stand-in for the adafruit neopixel module.
+# Frames are recorded instead of being sent to a pin, so skylight can run and be measured off a Pi.
+import time
+
+RGB = "RGB"
+GRB = "GRB"
+RGBW = "RGBW"
+GRBW = "GRBW"
+
+class WriteLog:
+    """Records the frames written through neopixel_write."""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.bytes = 0
+        self.last_pin = None
+        self.last_buffer = b''
+        self.last_time = None
+        self.write_time = 0.0
+
+    def record(self, pin, buf):
+        start = time.perf_counter()
+        self.last_buffer = bytes(buf)
+        self.last_pin = pin
+        self.count += 1
+        self.bytes += len(self.last_buffer)
+        self.last_time = time.monotonic()
+        self.write_time += time.perf_counter() - start
+
+    def get_stats(self):
+        return {
+            "writes": self.count,
+            "bytes": self.bytes,
+            "write_time": self.write_time,
+        }
+
+writes = WriteLog()
+
+def neopixel_write(pin, buf):
+    writes.record(pin, buf)
+
+class NeoPixel:
+    def __init__(self, pin, n, *, bpp=3, brightness=1.0, auto_write=True, pixel_order=None):
+        self.pin = pin
+        self.n = n
+        self.pixel_order = pixel_order or (GRB if bpp == 3 else GRBW)
+        self.bpp = len(self.pixel_order)
+        self.brightness = brightness
+        self.auto_write = auto_write
+        self.pixels = [(0,) * self.bpp] * n
+
+    def __len__(self):
+        return self.n
+
+    def __getitem__(self, index):
+        return self.pixels[index]
+
+    def __setitem__(self, index, color):
+        if isinstance(index, slice):
+            self.pixels[index] = [tuple(c) for c in color]
+        else:
+            self.pixels[index] = tuple(color)
+        if self.auto_write:
+            self.show()
+
+    @property
+    def buf(self):
+        """The brightness adjusted pixel data in wire order."""
+        buf = bytearray(self.n * self.bpp)
+        for i, pixel in enumerate(self.pixels):
+            for channel, value in zip("RGBW", pixel):
+                if channel in self.pixel_order:
+                    buf[i * self.bpp + self.pixel_order.index(channel)] = int(value * self.brightness)
+        return buf
+
+    def fill(self, color):
+        self.pixels = [tuple(color)] * self.n
+        if self.auto_write:
+            self.show()
+
+    def show(self):
+        neopixel_write(self.pin, self.buf)
+
+    def deinit(self):
+        pass
@@ -0,0 +1,181 @@
+import asyncio
+import json
+import time
+import websockets
+from skylight.moonraker_ingest import IngestPipeline
+from skylight.status_display import StatusDisplay
+from skylight.supervisor import Backoff
+from skylight.display_rules import RuleSet
+
+class PrinterConnection:
+    """One Moonraker connection: its own subscription, reconnects, printer state and strip segment."""
+
+    # Moonraker object fields reported by get_state, the display rules add the fields they read
+    status_fields = {
+        "print_stats": ["state"],
+    }
+
+    def __init__(self, name, host, port, segment, update_interval=5, min_update_interval=0.25,
+                 retry_interval=30, ping_interval=10, extra_fields=(), rules=None, debug=False):
+        self.name = name
+        self.set_websocket_url(host, port)
+        self.segment = segment
+        self.rule_set = rules or RuleSet.default()
+        self.rules = self.rule_set.evaluator()
+        self.status_display = StatusDisplay(segment, segment.length, self.rule_set.layouts)
+        # retry_interval caps the reconnect backoff, pings detect a dead Moonraker within ~2 ping intervals
+        self.backoff = Backoff(cap=retry_interval)
+        self.ping_interval = ping_interval
+        self.extra_fields = list(extra_fields)
+        self.debug = debug
+        self.connection = None
+        self.connected = False
+        self.connections = 0
+        self.reconnects = 0
+        self.downtime = 0.0
+        self.connected_since = None
+        self.disconnected_since = time.monotonic()
+        self.ingest = IngestPipeline(self.apply_status_update, min_update_interval, update_interval, debug)
+
+        self.printer_state = "idle"
+        self.event_received = None
+
+    def set_websocket_url(self, host, port):
+        self.websocket_url = f"ws://{host}:{port}/websocket"
+
+    def subscription_objects(self):
+        """Moonraker objects and the fields of each one that skylight needs."""
+        objects = self.rule_set.objects(self.status_fields)
+        for field in self.extra_fields:
+            # The field name follows the last dot, object names may contain spaces ("temperature_sensor mcu.temperature")
+            name, _, key = field.rpartition('.')
+            if name and key and key not in objects.setdefault(name, []):
+                objects[name].append(key)
+        return objects
+
+    async def connect(self):
+        while True:
+            try:
+                self.connection = await websockets.connect(self.websocket_url, ping_interval=self.ping_interval,
+                                                           ping_timeout=self.ping_interval)
+                # Requested printer objects
+                params = {"objects": self.subscription_objects()}
+                # Subscription request
+                subscription_request = {
+                    "jsonrpc": "2.0",
+                    "method": "printer.objects.subscribe",
+                    "params": params,
+                    "id": 1
+                }
+
+                await self.send_request(subscription_request)
+                # Query request for current status
+                query_request = {
+                    "jsonrpc": "2.0",
+                    "method": "printer.objects.query",
+                    "params": params,
+                    "id": 2
+                }
+                await self.send_request(query_request)
+                self.set_connected()
+                if self.debug:
+                    print(f"{self.name}: Connected to Moonraker server: {self.websocket_url}")
+                return True
+            except Exception as e:
+                if self.debug:
+                    print(f"{self.name}: Connection error: {e}")
+            delay = self.backoff.next_delay()
+            if self.debug:
+                print(f"{self.name}: Retrying in {delay:.1f} seconds...")
+            await asyncio.sleep(delay)
+
+    def set_connected(self):
+        self.connected = True
+        if self.connections:
+            self.reconnects += 1
+        self.connections += 1
+        self.connected_since = time.monotonic()
+        self.downtime += self.connected_since - self.disconnected_since
+        self.disconnected_since = None
+
+    def set_disconnected(self):
+        if self.connected:
+            self.connected = False
+            self.disconnected_since = time.monotonic()
+            # A connection that held up starts over with a fast retry, one that flaps keeps backing off
+            if self.disconnected_since - self.connected_since > self.backoff.cap:
+                self.backoff.reset()
+
+    async def send_request(self, request):
+        await self.connection.send(json.dumps(request))
+
+    async def receive_updates(self):
+        """Read status updates until the connection closes or stops answering pings."""
+        try:
+            await self.ingest.read(self.connection)
+        except websockets.exceptions.ConnectionClosed:
+            pass
+        except Exception as e:
+            print(f"{self.name}: Error receiving updates: {e}")
+        finally:
+            self.set_disconnected()
+            await self.connection.close()
+        if self.debug:
+            print(f"{self.name}: Connection lost. Attempting to reconnect...")
+
+    async def run(self):
+        """Keep this printer connected and its segment up to date, independent of the other printers."""
+        ingest_task = asyncio.ensure_future(self.ingest.consume())
+        try:
+            while True:
+                await self.connect()
+                await self.receive_updates()
+                await asyncio.sleep(self.backoff.next_delay())
+        finally:
+            ingest_task.cancel()
+
+    def get_downtime(self):
+        """Total seconds spent disconnected, including the current outage."""
+        if self.disconnected_since is None:
+            return self.downtime
+        return self.downtime + time.monotonic() - self.disconnected_since
+
+    def apply_status_update(self, state):
+        """Called by the ingest pipeline with the merged printer status."""
+        if self.debug:
+            print(f'{self.name}: status: {state.status}')
+        # Arrival of the first status message this update reflects, for the event to photon latency
+        self.event_received = state.first_pending_time
+        # standby, printing, paused, cancelled, completed, error
+        self.printer_state = state.get("print_stats", "state", self.printer_state)
+        # The first apply after connecting evaluates every rule, later ones only the rules whose fields changed
+        changed_fields = state.changed_fields if self.status_display.mode is not None else None
+        self.update_led_controller(state, changed_fields)
+
+    def update_led_controller(self, state, changed_fields=None):
+        mode, value = self.rules.evaluate(state, changed_fields)
+        if self.debug:
+            print(self.name, self.printer_state, mode, value)
+        if mode is not None:
+            self.update_status_leds(mode, value)
+
+    def update_status_leds(self, mode, percent=0):
+        if self.status_display.update(mode, percent):
+            if self.event_received is not None:
+                self.segment.note_event(self.event_received)
+            if self.debug:
+                print(f"{self.name}: update_status_leds: {mode}  {percent}")
+
+    def get_state(self):
+        return {
+            "name": self.name,
+            "url": self.websocket_url,
+            "connected": self.connected,
+            "reconnects": self.reconnects,
+            "downtime": round(self.get_downtime(), 1),
+            "printer_state": self.printer_state,
+            "rule_evaluations": self.rules.evaluations,
+            "segment": [self.segment.start, self.segment.length],
+            "display": self.status_display.get_stats(),
+            "ingest": self.ingest.get_stats(),
+        }
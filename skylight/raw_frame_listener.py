@@ -0,0 +1,89 @@
+import asyncio
+import struct
+
+# DDP (Distributed Display Protocol) header: flags, sequence, data type, destination id, data offset, data length
+HEADER = struct.Struct('>BBBBIH')
+VERSION_MASK = 0xC0
+VERSION_1 = 0x40
+FLAG_TIMECODE = 0x10
+FLAG_QUERY = 0x02
+FLAG_PUSH = 0x01
+# Destination 1 is the default display, 0 is sent by some senders that leave it unset
+DISPLAY_IDS = (0, 1)
+
+class RawFrameListener(asyncio.DatagramProtocol):
+    """UDP listener for DDP pixel data, written straight into the LEDController's frame buffer.
+
+    Each packet carries packed r, g, b bytes for a range of the strip. Packets with the push flag show
+    the frame, so a sender can split a long strip over several packets and push with the last one.
+    While packets keep arriving they override the effects, which resume after the controller's raw_timeout.
+    """
+
+    def __init__(self, led_controller, debug=False):
+        self.led_controller = led_controller
+        self.debug = debug
+        self.transport = None
+        self.sequence = 0
+        self.received = 0
+        self.dropped = 0
+        self.late = 0
+        self.frames = 0
+
+    async def start(self, host, port):
+        loop = asyncio.get_running_loop()
+        self.transport, _ = await loop.create_datagram_endpoint(lambda: self, local_addr=(host, port))
+        if self.debug:
+            print(f"Listening for DDP frames on udp {host}:{port}")
+
+    async def serve(self, host, port):
+        """Listen until cancelled."""
+        await self.start(host, port)
+        try:
+            await asyncio.Future()
+        finally:
+            self.transport.close()
+
+    def datagram_received(self, data, addr):
+        self.received += 1
+        if len(data) < HEADER.size:
+            self.dropped += 1
+            return
+        flags, sequence, _, destination, offset, length = HEADER.unpack_from(data)
+        header_size = HEADER.size + (4 if flags & FLAG_TIMECODE else 0)
+        if ((flags & VERSION_MASK) != VERSION_1 or flags & FLAG_QUERY or destination not in DISPLAY_IDS
+                or offset % 3 or len(data) < header_size + length):
+            self.dropped += 1
+            return
+        if self.is_late(sequence & 0x0F):
+            self.late += 1
+            return
+        push = bool(flags & FLAG_PUSH)
+        try:
+            self.led_controller.set_raw_frame(offset // 3, data[header_size:header_size + length], push)
+        except Exception as e:
+            self.dropped += 1
+            if self.debug:
+                print(f"Error writing DDP frame from {addr}: {e}")
+            return
+        if push:
+            self.frames += 1
+
+    def is_late(self, sequence):
+        """True if the packet is older than the last one, sequence numbers count 1 to 15, 0 means unused.
+
+        Packets of one frame may share a sequence number, only a step backwards counts as late.
+        """
+        if not sequence:
+            return False
+        if self.sequence and (sequence - self.sequence) % 16 >= 8:
+            return True
+        self.sequence = sequence
+        return False
+
+    def get_stats(self):
+        return {
+            "received": self.received,
+            "dropped": self.dropped,
+            "late": self.late,
+            "frames": self.frames,
+        }
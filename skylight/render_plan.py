@@ -0,0 +1,56 @@
+from collections import namedtuple
+from skylight.color_utils import ColorUtils
+
+# One compiled data field. Everything that does not depend on the effect step is resolved here,
+# wire_* colors are already encoded by the renderer in wire order with brightness applied,
+# table is the renderer's precomputed lookup table for modes whose colors change with the step,
+# or the Playback of the animation file a file segment plays,
+# render is the renderer's bound method for the field's mode.
+Segment = namedtuple('Segment', ['mode', 'start', 'length', 'color', 'bg_color', 'value', 'progress', 'bits',
+                                 'wire_color', 'wire_bg_color', 'wire_fade_color', 'table', 'render'])
+
+class RenderPlan:
+    """Immutable, precompiled form of LEDController.data_fields and data_values.
+
+    The plan keeps the fields and values it was compiled from, so it is a complete snapshot of the
+    render state that can be published to the effects thread with a single assignment.
+    """
+    __slots__ = ('segments', 'data_fields', 'data_values')
+
+    def __init__(self, segments=(), data_fields=(), data_values=()):
+        object.__setattr__(self, 'segments', tuple(segments))
+        object.__setattr__(self, 'data_fields', tuple(data_fields))
+        object.__setattr__(self, 'data_values', tuple(data_values))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("RenderPlan is immutable")
+
+    def __len__(self):
+        return len(self.segments)
+
+    @staticmethod
+    def compile(data_fields, data_values, renderer, palette=None, restart=()):
+        """Resolve offsets, wire colors and renderers for every field. Fields without a renderer stay black.
+
+        Wire colors are encoded with palette when given, for a brightness that is applied once the plan compiled.
+        File fields starting at a pixel in restart play from their first frame.
+        """
+        segments = []
+        start = 0
+        for (mode, length, color, bg_color, pad), value in zip(data_fields, data_values):
+            render = renderer.renderers.get(mode)
+            if render and length > 0:
+                if mode == "file":
+                    table = renderer.playback(value, start, length, start in restart)
+                else:
+                    table = renderer.color_table(mode, color, bg_color, palette)
+                is_float = isinstance(value, float)
+                progress = int(length * value) if is_float else 0
+                fade_color = ColorUtils.blend_colors(color, bg_color, value) if is_float else color
+                segments.append(Segment(mode, start, length, color, bg_color, value,
+                                        progress, renderer.bit_mask(value, length),
+                                        renderer.encode(color, palette), renderer.encode(bg_color, palette),
+                                        renderer.encode(fade_color, palette), table,
+                                        render))
+            start += length + pad
+        return RenderPlan(segments, data_fields, data_values)
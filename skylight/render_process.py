@@ -0,0 +1,141 @@
+import multiprocessing
+import struct
+import threading
+from multiprocessing import shared_memory
+
+# Shared memory layout: little endian uint32 count of frames shown and frame length, then the frame bytes
+HEADER = struct.Struct('<II')
+
+def run_renderer(connection, shm_name, controller_args):
+    """Entry point of the render process: own the LEDController and apply commands from the pipe."""
+    # The parent loads this module too, through the skylight package, but only this process opens the strip
+    from skylight.led_controller import LEDController
+
+    controller = LEDController(**controller_args)
+    shm = shared_memory.SharedMemory(name=shm_name)
+    shown = 0
+
+    def publish(buf):
+        nonlocal shown
+        shown += 1
+        shm.buf[HEADER.size:HEADER.size + len(buf)] = buf
+        HEADER.pack_into(shm.buf, 0, shown, len(buf))
+
+    controller.add_show_callback(publish)
+    try:
+        while True:
+            try:
+                method, args, kwargs, reply = connection.recv()
+            except EOFError:
+                break
+            if method == "stop":
+                break
+            try:
+                result = getattr(controller, method)(*args, **kwargs)
+            except Exception as e:
+                if not reply:
+                    print(f"Error in render process {method}: {e}")
+                result = e
+            if reply:
+                connection.send(result)
+    finally:
+        controller.stop()
+        shm.close()
+
+class RenderProcess:
+    """LEDController stand-in that renders and drives the strip in a dedicated process.
+
+    Commands are forwarded over a pipe, so the asyncio loop and the renderer never share a GIL.
+    The last frame shown is published in shared memory for inspection.
+    """
+
+    def __init__(self, led_count=30, **controller_args):
+        self.led_count = led_count
+        controller_args["led_count"] = led_count
+        # Sized for up to 4 bytes per pixel (RGBW)
+        self.shm = shared_memory.SharedMemory(create=True, size=HEADER.size + led_count * 4)
+        self.connection, child_connection = multiprocessing.Pipe()
+        self.lock = threading.Lock()
+        self.process = multiprocessing.Process(target=run_renderer, name="skylight-render",
+                                               args=(child_connection, self.shm.name, controller_args),
+                                               daemon=True)
+        self.process.start()
+        child_connection.close()
+
+    def call(self, method, *args, reply=False, **kwargs):
+        with self.lock:
+            self.connection.send((method, args, kwargs, reply))
+            if not reply:
+                return None
+            result = self.connection.recv()
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    # Commands that change the render state wait for the reply, so the caller sees rejected values
+    def set_data_fields(self, data_fields):
+        self.call("set_data_fields", data_fields, reply=True)
+
+    def set_data_values(self, data_values):
+        self.call("set_data_values", data_values, reply=True)
+
+    def set_brightness(self, brightness):
+        self.call("set_brightness", brightness, reply=True)
+
+    def play_file(self, path, index=None):
+        # Replies so a missing or invalid file is reported to the caller
+        self.call("play_file", path, index, reply=True)
+
+    def apply_batch(self, commands):
+        self.call("apply_batch", commands, reply=True)
+
+    def set_raw_frame(self, index, data, push=True):
+        self.call("set_raw_frame", index, data, push)
+
+    def set_fps(self, fps):
+        self.call("set_fps", fps)
+
+    def set_fps_limits(self, max_fps=None, min_fps=1):
+        self.call("set_fps_limits", max_fps, min_fps)
+
+    def fill(self, color):
+        self.call("fill", color)
+
+    def clear(self):
+        self.call("clear")
+
+    def start_effects(self, effect_function, **params):
+        self.call("start_effects", effect_function, reply=True, **params)
+
+    def stop_effects(self):
+        self.call("stop_effects")
+
+    def get_state(self):
+        return self.call("get_state", reply=True)
+
+    def note_event(self, event_time):
+        self.call("note_event", event_time)
+
+    def get_metrics(self):
+        return self.call("get_metrics", reply=True)
+
+    def get_pixel_format(self):
+        return self.call("get_pixel_format", reply=True)
+
+    def get_frame_count(self):
+        """Number of frames the render process has shown."""
+        return HEADER.unpack_from(self.shm.buf, 0)[0]
+
+    def get_pixels(self):
+        """Copy of the last frame shown, wire ordered bytes with brightness applied."""
+        length = HEADER.unpack_from(self.shm.buf, 0)[1]
+        return bytes(self.shm.buf[HEADER.size:HEADER.size + length])
+
+    def stop(self):
+        if self.process.is_alive():
+            with self.lock:
+                self.connection.send(("stop", (), {}, False))
+            self.process.join(timeout=5)
+        self.connection.close()
+        self.shm.close()
+        self.shm.unlink()
@@ -0,0 +1,122 @@
+class StatusDisplay:
+    """Maps a display mode and value onto the LEDController, touching it only when the display changes.
+
+    A new mode rebuilds the data fields, a new value in the same mode only calls set_data_values, and
+    values are compared at the resolution of one LED so sub-LED changes do not reach the controller.
+    led_controller can also be a StripSegment, to draw on part of a shared strip.
+    """
+
+    # display mode: (effect, color, bg_color)
+    layouts = {
+        "temp": ("fade", "blue", "red"),
+        "progress": ("progress", "green", "white"),
+        "paused": ("chase", "black", "yellow"),
+        "idle": ("chase", "white", "black"),
+    }
+
+    def __init__(self, led_controller, length, layouts=None):
+        self.led_controller = led_controller
+        self.length = length
+        if layouts is not None:
+            self.layouts = layouts
+        self.mode = None
+        self.level = None
+        self.layout_changes = 0
+        self.value_changes = 0
+
+    def quantize(self, value):
+        """Number of whole LEDs the value covers, the finest step the strip can show."""
+        if not isinstance(value, (int, float)):
+            return 0
+        return int(self.length * max(min(value, 1.0), 0.0))
+
+    def fields(self, mode, value):
+        effect, color, bg_color = self.layouts[mode]
+        return [[effect, float(value), self.length, color, bg_color, 0]]
+
+    def update(self, mode, value=0):
+        """Show mode with value. Returns True if the LEDController was updated."""
+        level = self.quantize(value)
+        if mode != self.mode:
+            self.led_controller.set_data_fields(self.fields(mode, value))
+            self.layout_changes += 1
+        elif level != self.level:
+            self.led_controller.set_data_values([float(value)])
+            self.value_changes += 1
+        else:
+            return False
+        self.mode, self.level = mode, level
+        return True
+
+    def invalidate(self):
+        """The data fields were replaced from elsewhere, rebuild them on the next update."""
+        self.mode = None
+        self.level = None
+
+    def get_stats(self):
+        return {
+            "mode": self.mode,
+            "layout_changes": self.layout_changes,
+            "value_changes": self.value_changes,
+        }
+
+class StripSegment:
+    """The part of the strip owned by one StatusDisplay.
+
+    It offers the set_data_fields/set_data_values interface of LEDController and forwards changes to
+    the StripLayout, which composes all segments into the controller's single set of data fields.
+    """
+
+    def __init__(self, layout, start, length):
+        self.layout = layout
+        self.start = start
+        self.length = length
+        self.fields = [["off", 0.0, length, "black", "black", 0]]
+        self.values = [0.0]
+
+    def set_data_fields(self, fields):
+        self.fields = [list(field) for field in fields]
+        self.values = [field[1] for field in self.fields]
+        self.layout.set_data_fields()
+
+    def set_data_values(self, values):
+        self.values[:len(values)] = values
+        self.layout.set_data_values()
+
+    def note_event(self, event_time):
+        self.layout.led_controller.note_event(event_time)
+
+class StripLayout:
+    """Composes the fields of several strip segments into one layout for the LEDController."""
+
+    def __init__(self, led_controller, led_count):
+        self.led_controller = led_controller
+        self.led_count = led_count
+        self.segments = []
+
+    def add_segment(self, start, length):
+        """Reserve LEDs start to start+length-1 and return the StripSegment that draws on them."""
+        if start < 0 or length <= 0 or start + length > self.led_count:
+            raise ValueError(f"Segment {start}+{length} does not fit a strip of {self.led_count} leds")
+        for segment in self.segments:
+            if start < segment.start + segment.length and segment.start < start + length:
+                raise ValueError(f"Segment {start}+{length} overlaps segment {segment.start}+{segment.length}")
+        segment = StripSegment(self, start, length)
+        self.segments.append(segment)
+        self.segments.sort(key=lambda s: s.start)
+        return segment
+
+    def layout(self):
+        """Yield (fields, values) for every segment in strip order, with black fields filling the gaps."""
+        position = 0
+        for segment in self.segments:
+            if segment.start > position:
+                yield [["off", 0.0, segment.start - position, "black", "black", 0]], [0.0]
+            yield segment.fields, segment.values
+            position = segment.start + segment.length
+
+    def set_data_fields(self):
+        self.led_controller.set_data_fields([field for fields, _ in self.layout() for field in fields])
+
+    def set_data_values(self):
+        self.led_controller.set_data_values([value for _, values in self.layout() for value in values])
@@ -0,0 +1,41 @@
+import asyncio
+import random
+import time
+
+class Backoff:
+    """Retry delays: a fast first retry, then exponential growth with jitter up to a cap."""
+
+    def __init__(self, first=0.5, base=1.0, cap=30.0, factor=2.0):
+        self.first = first
+        self.base = base
+        self.cap = cap
+        self.factor = factor
+        self.attempt = 0
+
+    def reset(self):
+        self.attempt = 0
+
+    def next_delay(self):
+        self.attempt += 1
+        if self.attempt == 1:
+            return self.first
+        delay = min(self.cap, self.base * self.factor ** (self.attempt - 2))
+        # Half fixed, half random, so a rack of printers restarting together does not reconnect in lockstep
+        return delay / 2 + random.uniform(0, delay / 2)
+
+async def supervise(name, task_factory, backoff, debug=False):
+    """Run task_factory() forever, restarting it with backoff whenever it returns or raises."""
+    while True:
+        started = time.monotonic()
+        try:
+            await task_factory()
+            if debug:
+                print(f"{name} stopped, restarting")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Error in {name}: {e}")
+        # A task that ran for a while failed for a new reason, start over with a fast retry
+        if time.monotonic() - started > backoff.cap:
+            backoff.reset()
+        await asyncio.sleep(backoff.next_delay())
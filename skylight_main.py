@@ -1,15 +1,22 @@
+import time
+STARTED = time.monotonic()
 import sys
 import os
 # Add the root directory of your project to the Python path
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-import pwd
-import time
 import asyncio
-import websockets
 import json
 import configparser
+# Only what the boot frame needs is imported here, websockets and the printer connections are
+# imported after the strip is lit
 from skylight.led_controller import LEDController
+from skylight.raw_frame_listener import RawFrameListener
+from skylight.frame_feed import FrameFeed
+from skylight.metrics import PhaseTimer, serve_prometheus
+from skylight.status_display import StripLayout
+from skylight.display_rules import DEFAULT_RULES, RuleSet
+from skylight.supervisor import Backoff, supervise
 
 # skylight_main.py
 # The skylight service includes the following functionality:
@@ -17,261 +24,287 @@ from skylight.led_controller import LEDController
 #  2. To receive printer status messages from moonraker
 #  3. Use the LEDController class to set specific led colors.
 #
+# Several printers can share one strip, each listed in its own [printer <name>] section:
+#   [printer voron]
+#   moonraker_host = voron.local
+#   moonraker_port = 7125
+#   led_start = 0
+#   led_count = 15
+# Without printer sections, the moonraker host and port in [skylight] drive the whole strip.
+#
+# What a printer segment shows is decided by [rule <name>] sections, tried in file order:
+#   [rule chamber_hot]
+#   when = "temperature_sensor chamber".temperature > 45
+#   effect = breathe
+#   color = yellow
+#   bg_color = black
+# A rule either names a display (temp, progress, paused, idle) or brings its own effect and colors,
+# value sets the fraction shown, e.g. value = extruder.temperature / extruder.target.
+# The moonraker fields to subscribe to are taken from the rules.
+#
+# Animations rendered offline (see skylight/animation_file.py) play over a data field with mode "file"
+# and the file's path as value, e.g. ["file", "sunrise.sky", 30, "", "black", 0], or with the
+# play_file command: {"action": "play_file", "params": {"file": "sunrise.sky", "segment": 1}}.
+#
 
 class SkylightService:
-    def __init__(self, config_file):
+    def __init__(self, config_file, started=STARTED):
+        # Startup phases are timed from the start of the process, or from the given time.monotonic()
+        self.startup = PhaseTimer(started)
+        self.startup.mark("imports")
         # Initialize Skylight config
         config = configparser.ConfigParser()
         config_exists = os.path.exists(config_file)
         if config_exists:
             config.read(config_file)
         # Check if the 'skylight' section exists or if the file doesn't exist
-        if not config_exists or 'skylight' not in config:
-            self.create_default_config(config, config_file)
+        save_config = not config_exists or 'skylight' not in config
+        if save_config:
+            self.create_default_config(config)
 
         skylight_config = config['skylight']
         self.skylight_host = skylight_config.get('skylight_host', 'localhost')
         self.skylight_port = skylight_config.getint('skylight_port', 6789)
         self.led_count = skylight_config.getint('led_count', 30)
+        self.fps = skylight_config.getint('fps', 30)
+        self.max_fps = skylight_config.getfloat('max_fps', self.fps)
+        self.min_fps = skylight_config.getfloat('min_fps', 1)
         self.moonraker_host = skylight_config.get('moonraker_host', 'localhost')
         self.moonraker_port = skylight_config.getint('moonraker_port', 7125)
         self.display_updates = skylight_config.getboolean('display_updates', True)
         self.update_interval = skylight_config.getint('update_interval', 5)
+        self.min_update_interval = skylight_config.getfloat('min_update_interval', 0.25)
         self.retry_interval = skylight_config.getint('retry_interval', 30)
+        self.ping_interval = skylight_config.getfloat('ping_interval', 10)
         self.debug = skylight_config.getboolean('debug', False)
+        self.render_process = skylight_config.getboolean('render_process', False)
+        self.raw_port = skylight_config.getint('raw_port', 0)
+        self.raw_timeout = skylight_config.getfloat('raw_timeout', 2.0)
+        self.metrics_port = skylight_config.getint('metrics_port', 0)
+        self.boot_color = skylight_config.get('boot_color', 'dark-blue')
+        # Relative animation paths are found here, a relative directory is next to the config file
+        self.animation_dir = os.path.join(os.path.dirname(os.path.abspath(config_file)),
+                                          os.path.expanduser(skylight_config.get('animation_dir', 'animations')))
+        self.extra_fields = [field.strip() for field in skylight_config.get('extra_fields', '').split(',') if field.strip()]
         print("display_updates =", self.display_updates)
         print("debug =", self.debug)
-        self.set_websocket_url(self.moonraker_host, self.moonraker_port)
         self.skylight_websocket_uri = f"ws://{self.skylight_host}:{self.skylight_port}"
-
-        # Initialize LEDController
-        self.led_controller = LEDController(led_count=self.led_count)
-        self.led_controller.set_effect(self.led_controller.effects_loop)
+        self.startup.mark("config")
+
+        # Initialize LEDController, optionally in its own process so websocket traffic cannot delay frames.
+        # It shows the boot frame before setting up its renderer.
+        controller_args = dict(led_count=self.led_count, fps=self.fps, max_fps=self.max_fps, min_fps=self.min_fps,
+                               raw_timeout=self.raw_timeout, boot_color=self.boot_color,
+                               animation_dir=self.animation_dir)
+        if self.render_process:
+            from skylight.render_process import RenderProcess
+            self.led_controller = RenderProcess(**controller_args)
+        else:
+            self.led_controller = LEDController(**controller_args)
+        self.startup.mark("led_controller")
+        if getattr(self.led_controller, 'boot_time', None):
+            self.startup.at("boot_frame_at", self.led_controller.boot_time)
         default_effect = [['rainbow', 0, self.led_count, '', '', 0]]
         self.led_controller.set_data_fields(default_effect)
-        time.sleep(5)
-
-        self.printer_state = "idle"
-        self.current_temp = 0
-        self.target_temp = 0
-        self.percent_complete = 0
-        self.print_progress = 0
-
-    def create_default_config(self, config, config_file, username='pi'):
+        if save_config:
+            self.save_config(config, config_file)
+        self.strip_layout = StripLayout(self.led_controller, self.led_count)
+        self.rules = RuleSet.from_config(config)
+        self.printers = self.load_printers(config)
+        self.raw_listener = RawFrameListener(self.led_controller, self.debug) if self.raw_port else None
+        self.frame_feed = FrameFeed(self.led_controller, self.fps)
+        self.startup.mark("printers")
+
+    def create_default_config(self, config):
         config['skylight'] = {
             'skylight_host': 'localhost',   # host controlling the neopixels
             'skylight_port': '6791',        # port to listen for skylight commands
             'led_count': '30',              # number of neopixels
+            'fps': '30',                    # target frame rate of the led effects
+            'max_fps': '30',                # most frames rendered per second, lower to save cpu on fast effects
+            'min_fps': '1',                 # refresh rate of a static strip, 0 to render only on changes
             'moonraker_host': 'localhost',  # host running moonraker
             'moonraker_port': '7125',       # port to query/subscribe for status updates
             'display_updates': 'True',      # display moonraker updates, or not
             'update_interval': '5',         # delay between status updates
-            'retry_interval': '30',         # delay to reconnect to moonraker
+            'min_update_interval': '0.25',  # minimum delay between led updates when status changes
+            'retry_interval': '30',         # maximum delay to reconnect to moonraker
+            'ping_interval': '10',          # delay between websocket pings to detect a dead connection
+            'render_process': 'False',      # render the leds in a separate process, or not
+            'raw_port': '0',                # udp port for streamed DDP pixel frames, e.g. 4048, 0 to disable
+            'raw_timeout': '2.0',           # seconds after the last streamed frame before the effects resume
+            'metrics_port': '0',            # http port serving prometheus metrics, e.g. 9101, 0 to disable
+            'boot_color': 'dark-blue',      # color shown while the service starts
+            'animation_dir': 'animations',  # directory of pre-rendered animation files for the file effect
+            'extra_fields': '',             # more moonraker fields to subscribe to, e.g. heater_bed.temperature
             'debug': 'False'                # display debug output, or not
         }
+        # The first rule whose condition holds picks the display, see skylight/display_rules.py
+        for name, options in DEFAULT_RULES:
+            config[f'rule {name}'] = options
+
+    def save_config(self, config, config_file):
         with open(config_file, 'w') as file:
             config.write(file)
+        # Give the file to the owner of its directory, so it stays editable when the service runs as root
+        directory = os.stat(os.path.dirname(os.path.abspath(config_file)))
         try:
-            user_info = pwd.getpwnam(username)
-            print(f"user_info = {user_info}")
-            os.chown(config_file, user_info.pw_uid, user_info.pw_gid)
-        except KeyError:
-            print(f"User '{username}' does not exist")
-
-    def set_websocket_url(self, host, port):
-        self.websocket_url = f"ws://{host}:{port}/websocket"
-
-    async def connect(self):
-        while True:
-            try:
-                self.connection = await websockets.connect(self.websocket_url)
-                # Requested printer objects
-                params = {"objects": {"print_stats": None, "display_status": None, "extruder": None}}
-                # Subscription request
-                subscription_request = {
-                    "jsonrpc": "2.0",
-                    "method": "printer.objects.subscribe",
-                    "params": params,
-                    "id": 1
-                }
-
-                await self.send_request(subscription_request)
-                # Query request for current status
-                query_request = {
-                    "jsonrpc": "2.0",
-                    "method": "printer.objects.query",
-                    "params": params,
-                    "id": 2
-                }
-                await self.send_request(query_request)
-                if self.debug:
-                    print(f"Connected to Moonraker server: {self.websocket_url}")
-                return True
-            except Exception as e:
-                if self.debug:
-                    print(f"Connection error: {e}")
-            if self.debug:
-                print(f"Retrying in {self.retry_interval} seconds...")
-            await asyncio.sleep(self.retry_interval)
-
-    async def send_request(self, request):
-        await self.connection.send(json.dumps(request))
-
-    async def receive_updates(self):
-        last_processed_time = 0
-        while True:
-            try:
-                async for message in self.connection:
-                    current_time = time.time()
-                    response = json.loads(message)
-
-                    if response.get('method') == "notify_status_update":
-                        if self.debug:
-                            print(f"receive_updates: status_update = {response.get('params', None)}")
-                        status_update = response.get("params", [{}])[0]
-                        event_time = response.get("params", [{}, 0])[1]
-                        self.process_status_update(status_update, event_time)
-
-                    elif response.get("id") == 2:  # ID used for query response
-                        if self.debug:
-                            print(f"receive_updates: id = {response.get('id')}")
-                        query_response = response.get("result", {})
-                        status_update = query_response.get("status", {})
-                        event_time = query_response.get("eventtime", 0)
-                        self.process_status_update(status_update, event_time)
-
-                    elif response.get('method') == "notify_proc_stat_update":
-                        proc_stat = response.get('params', [{}])[0]
-                        cpu_temp = proc_stat.get("cpu_temp", 0.0) if proc_stat else None
-                        if self.debug:
-                            print(f"receive_updates: proc_stat_update ")    #= {response.get('params', None)}")
-                            print(f"CPU Temp = {cpu_temp}")
-
-                    elif self.debug:
-                        print(f"receive updates: {response.get('method')} = {response.get('params', None)}")
-
-                    if current_time - last_processed_time >= self.update_interval:
-                        self.update_led_controller()
-                        last_processed_time = current_time
-
-            except websockets.exceptions.ConnectionClosedError:
+            os.chown(config_file, directory.st_uid, directory.st_gid)
+        except OSError as e:
+            print(f"Cannot change the owner of {config_file}: {e}")
+
+    def load_printers(self, config):
+        """Create a PrinterConnection for every [printer <name>] section, each owning a strip segment."""
+        from skylight.printer_connection import PrinterConnection
+        sections = [name for name in config.sections() if name.startswith('printer ')]
+        if not sections:
+            sections = ['skylight']
+        default_count = self.led_count // len(sections)
+        printers = []
+        start = 0
+        for section in sections:
+            printer_config = config[section]
+            start = printer_config.getint('led_start', start)
+            length = printer_config.getint('led_count', default_count) if section != 'skylight' else self.led_count
+            name = section[len('printer '):].strip() if section != 'skylight' else 'printer'
+            printers.append(PrinterConnection(
+                name,
+                printer_config.get('moonraker_host', self.moonraker_host),
+                printer_config.getint('moonraker_port', self.moonraker_port),
+                self.strip_layout.add_segment(start, length),
+                update_interval=self.update_interval,
+                min_update_interval=self.min_update_interval,
+                retry_interval=self.retry_interval,
+                ping_interval=self.ping_interval,
+                extra_fields=self.extra_fields,
+                rules=self.rules,
+                debug=self.debug))
+            start += length
+        return printers
+
+    async def listen_for_skylight_commands(self, websocket, path=None):
+        """Apply commands from one client, replying to each unless it asked for no acknowledgement.
+
+        A command is {"action": ..., "params": ...}, optionally with an "id" echoed in the response so
+        a client can pipeline commands, and "ack": false to skip the response entirely.
+        {"action": "batch", "params": [command, ...]} applies its commands together in one frame.
+        {"action": "subscribe_frames", "params": {"fps": 10}} streams the strip to the client as binary messages.
+        """
+        try:
+            async for message in websocket:
                 if self.debug:
-                    print("Connection lost. Attempting to reconnect...")
-                await self.connect()
-
-    def process_query_response(self, query_response):
-        # Implement the logic to process the initial query response
-        pass
-
-    def process_status_update(self, status_update, event_time):
-        print(f'status: {status_update}')
-        extruder_status = status_update.get("extruder", None)
-        if extruder_status:
-            self.current_temp = extruder_status.get("temperature", self.current_temp)
-            self.target_temp = extruder_status.get("target", self.target_temp)
-        print_stats = status_update.get("print_stats", None)
-        if print_stats:
-            self.printer_state = print_stats.get("state", self.printer_state)
-        display_status = status_update.get("display_status", None)
-        if display_status:
-            self.print_progress = round(display_status.get("progress", self.print_progress) ) #, 4)
-
-    def update_led_controller(self):
-        if self.debug:
-            print(self.printer_state, self.current_temp, self.target_temp, self.print_progress)
-        # standby, printing, paused, cancelled, completed, error
-        heater_on = self.target_temp > 0
-        warming_up = heater_on and (abs(self.current_temp - self.target_temp) > 5)
-        cooling_down = (self.current_temp > 50)
-        if heater_on:
-            percent = self.current_temp / self.target_temp
-        else:
-            percent = self.current_temp / 250.0
-
-        if self.printer_state == "printing":
-            if warming_up:
-                self.update_status_leds("temp", percent)
-            else:
-                self.update_status_leds("progress", self.print_progress)
-        elif self.printer_state == "paused":
-            self.update_status_leds("paused")
-        elif cooling_down or heater_on:
-            self.update_status_leds("temp", percent)
-        else:
-            self.update_status_leds("idle")
-
-    def update_status_leds(self, mode, percent=0):
-        if self.debug:
-            print(f"update_status_leds: {mode}  {percent}")
-
-        if not self.led_controller:
-            return
-        if mode == 'temp':
-            self.led_controller.set_data_fields([["fade", percent, 30, "blue", "red", 0]])
-        elif mode == 'progress':
-            self.led_controller.set_data_fields([["progress", percent, 30, "green", "white", 0]])
-        elif mode == 'paused':
-            self.led_controller.set_data_fields([["chase", 0, 30, "black", "yellow", 0]])
-        elif mode == 'idle':
-            self.led_controller.set_data_fields([["chase", 0, 30, "white", "black", 0]])
-
-    async def listen_for_skylight_commands(self, websocket, path):
-        while True:
-            try:
-                async for message in websocket:
-                    # Process Skylight commands
                     print(f"Received Skylight command: {message}")
-                    try:
-                        # Decode the received message
-                        data = json.loads(message)
-                        print(f"Received data: {data}")
-
-                        # Determine the action and call the appropriate method
-                        action = data.get("action")
-                        params = data.get("params", {})
-
-                        if action == "set_data_values":
-                            self.led_controller.set_data_values(params)
-                        elif action == "set_data_fields":
-                            self.led_controller.set_data_fields(params)
-                        elif action == "start_effects":
-                            self.led_controller.start_effects(**params)
-                        elif action == "stop_effects":
-                            self.led_controller.stop_effects()
-                        else:
-                            raise ValueError("Invalid action")
-
-                        # Send a confirmation response
-                        response = {"status": "success", "action": action}
-                    except json.JSONDecodeError:
-                        response = {"status": "error", "message": "Invalid JSON format"}
-                    except KeyError:
-                        response = {"status": "error", "message": "Missing action or parameters"}
-                    except ValueError as e:
-                        response = {"status": "error", "message": str(e)}
-                    except Exception as e:
-                        response = {"status": "error", "message": f"An unexpected error occurred: {e}"}
-
+                data, ack = None, True
+                try:
+                    # Decode the received message
+                    data = json.loads(message)
+                    ack = data.get("ack", True)
+                    response = self.handle_command(data["action"], data.get("params", {}), websocket)
+                except json.JSONDecodeError:
+                    response = {"status": "error", "message": "Invalid JSON format"}
+                except (KeyError, TypeError):
+                    response = {"status": "error", "message": "Missing action or parameters"}
+                except ValueError as e:
+                    response = {"status": "error", "message": str(e)}
+                except Exception as e:
+                    response = {"status": "error", "message": f"An unexpected error occurred: {e}"}
+
+                if isinstance(data, dict) and "id" in data:
+                    response["id"] = data["id"]
+                if ack:
                     await websocket.send(json.dumps(response))
+                elif response["status"] == "error":
+                    print(f"Skylight command failed: {response['message']}")
+
+        except Exception as e:
+            # Only this client's connection ends, the server keeps running for everyone else
+            print(f"Error in Skylight WebSocket: {e}")
+        finally:
+            self.frame_feed.unsubscribe(websocket)
+
+    def handle_command(self, action, params, websocket=None):
+        """Apply one command and return its response."""
+        response = {"status": "success", "action": action}
+        if action == "set_data_values":
+            self.led_controller.set_data_values(params)
+        elif action == "set_data_fields":
+            self.led_controller.set_data_fields(params)
+            self.invalidate_status_displays()
+        elif action == "set_brightness":
+            self.led_controller.set_brightness(float(params))
+        elif action == "play_file":
+            # A file over the whole strip replaces the printer segments like set_data_fields
+            index = params.get("segment")
+            self.led_controller.play_file(params["file"], index)
+            if index is None:
+                self.invalidate_status_displays()
+        elif action == "batch":
+            commands = [(command["action"], command.get("params", {})) for command in params]
+            self.led_controller.apply_batch(commands)
+            if any(action == "set_data_fields" for action, _ in commands):
+                self.invalidate_status_displays()
+            response["count"] = len(commands)
+        elif action == "start_effects":
+            self.led_controller.start_effects(**params)
+        elif action == "stop_effects":
+            self.led_controller.stop_effects()
+        elif action == "subscribe_frames":
+            # Frames follow as binary messages, see FrameFeed for the encoding
+            response["fps"] = self.frame_feed.subscribe(websocket, params.get("fps", 10))
+        elif action == "unsubscribe_frames":
+            self.frame_feed.unsubscribe(websocket)
+        elif action == "stats":
+            response["stats"] = self.get_metrics()
+        elif action == "get_state":
+            state = self.led_controller.get_state()
+            state["printers"] = [printer.get_state() for printer in self.printers]
+            state["frame_feed"] = self.frame_feed.get_stats()
+            if self.raw_listener:
+                state["raw_frames"] = self.raw_listener.get_stats()
+            response["state"] = state
+        else:
+            raise ValueError("Invalid action")
+        return response
+
+    def get_metrics(self):
+        return {
+            "startup": self.startup.get_stats(),
+            "render": self.led_controller.get_metrics(),
+            "printers": {printer.name: printer.ingest.get_metrics() for printer in self.printers},
+        }
 
-            except Exception as e:
-                print(f"Error in Skylight WebSocket: {e}")
-                await asyncio.sleep(self.retry_interval)  # Retry after the specified interval
+    def invalidate_status_displays(self):
+        # The data fields were replaced by a client, printers rebuild their segments on the next update
+        for printer in self.printers:
+            printer.status_display.invalidate()
 
     async def skylight_handler(self):
+        import websockets
         async with websockets.serve(self.listen_for_skylight_commands, self.skylight_host, self.skylight_port):
+            if "command_server" not in self.startup.phases:
+                self.startup.mark("command_server")
+                print(f"Startup: {self.startup.get_stats()}")
             await asyncio.Future()  # Keeps the server running indefinitely
 
+    async def serve(self):
+        """Run the command server, every printer and the optional listeners until cancelled."""
+        # Each one is supervised separately, a Moonraker outage never takes the command port down
+        # and each printer reconnects on its own
+        tasks = [("skylight server", self.skylight_handler)]
+        tasks += [(f"printer {printer.name}", printer.run) for printer in self.printers]
+        if self.raw_listener:
+            tasks.append(("raw frame listener", lambda: self.raw_listener.serve(self.skylight_host, self.raw_port)))
+        if self.metrics_port:
+            tasks.append(("metrics server", lambda: serve_prometheus(self.skylight_host, self.metrics_port,
+                                                                     self.get_metrics)))
+        await asyncio.gather(*[supervise(name, task, Backoff(cap=self.retry_interval), self.debug)
+                               for name, task in tasks])
+
     def run(self):
         loop = asyncio.get_event_loop()
         while True:
             try:
-                connected = loop.run_until_complete(self.connect())
-                print(f"connected = {connected}")
-                if connected:
-                    moonraker_task = loop.create_task(self.receive_updates())
-                    skylight_task = loop.create_task(self.skylight_handler())
-                    loop.run_until_complete(asyncio.gather(moonraker_task, skylight_task))
+                loop.run_until_complete(self.serve())
             except Exception as e:
                 print(f"Error caught in run(): {e}")
             if self.debug: